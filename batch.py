@@ -0,0 +1,100 @@
+import os
+import json
+import glob
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field, asdict
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+@dataclass
+class BatchResult:
+    path: str
+    func_name: str
+    output: Optional[str] = None
+    error: Optional[str] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def find_kernels(directory: str, pattern: str = '**/*.c') -> List[Tuple[str, str]]:
+    """ 在目录中查找所有含有 `#pragma scop` 的 (文件, 函数) 对. """
+    from common import find_scop_functions
+    jobs = []
+    for path in sorted(glob.glob(os.path.join(directory, pattern), recursive=True)):
+        with open(path, 'r') as f:
+            source = f.read()
+        for func_name, _ in find_scop_functions(source):
+            jobs.append((path, func_name))
+    return jobs
+
+
+def _output_path(out_dir: str, root: str, path: str, func_name: str) -> str:
+    rel = os.path.splitext(os.path.relpath(path, root))[0]
+    return os.path.join(out_dir, rel, func_name + '.c')
+
+
+def _run_job(path: str, func_name: str, output: str, schedule_fn: Optional[Callable]) -> BatchResult:
+    """ 在 worker 进程中执行 解析 -> 调度 -> 代码生成. """
+    # spawn 出来的 worker 在这里第一次导入 isl, 因此拥有自己的 isl_ctx.
+    from common import CodeGenerator, compute_schedule, parse_code
+    result = BatchResult(path, func_name)
+    try:
+        t0 = time.perf_counter()
+        with open(path, 'r') as f:
+            source = f.read()
+        scop = parse_code(source, func_name)
+        t1 = time.perf_counter()
+        schedule = (schedule_fn or compute_schedule)(scop)
+        t2 = time.perf_counter()
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        with open(output, 'w') as f:
+            CodeGenerator(scop, schedule).generate(sink=f)
+        t3 = time.perf_counter()
+        result.output = output
+        result.timings = {'extract': t1 - t0, 'schedule': t2 - t1,
+                          'codegen': t3 - t2, 'total': t3 - t0}
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+    return result
+
+
+def run_batch(jobs: Iterable[Tuple[str, str]], out_dir: str,
+              schedule_fn: Optional[Callable] = None,
+              max_workers: Optional[int] = None,
+              manifest: str = 'manifest.json') -> Iterator[BatchResult]:
+    """ 用进程池批量处理 (文件, 函数) 对, 按完成顺序返回结果.
+
+    :param jobs: (C 文件路径, 函数名) 列表.
+    :param out_dir: 输出目录, 保持输入文件的相对目录结构, 每个函数一个 .c 文件.
+    :param schedule_fn: scop -> isl.schedule, 需要可以被 pickle; 默认为 compute_schedule.
+    :param max_workers: 进程数, 默认为 cpu 个数.
+    :param manifest: 记录每个 kernel 耗时的清单文件名, 全部完成后写入 out_dir.
+    """
+    jobs = list(jobs)
+    if len(jobs) == 0:
+        return
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(p)) for p, _ in jobs])
+    os.makedirs(out_dir, exist_ok=True)
+    results: List[BatchResult] = []
+    start = time.perf_counter()
+    # 使用 spawn 而不是 fork, 避免子进程继承父进程中的 isl_ctx.
+    ctx = multiprocessing.get_context('spawn')
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=ctx) as pool:
+            futures = [pool.submit(_run_job, os.path.abspath(path), func_name,
+                                   _output_path(out_dir, root, os.path.abspath(path), func_name),
+                                   schedule_fn)
+                       for path, func_name in jobs]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                yield result
+    finally:
+        with open(os.path.join(out_dir, manifest), 'w') as f:
+            json.dump({'wall_time': time.perf_counter() - start,
+                       'kernels': [asdict(r) for r in results]}, f, indent=2)
@@ -0,0 +1,342 @@
+import os
+import re
+import json
+import shutil
+import tempfile
+import subprocess
+import statistics
+import numpy as np
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional, Sequence, Tuple
+import pandas
+from common import CSource, find_function, kernel_source, restrict_array_params, split_params
+
+
+DEFAULT_FLAGS = ['-O3', '-march=native']
+
+_QUALIFIERS = {'const', 'volatile', 'restrict', '__restrict', '__restrict__', 'static', 'register'}
+_FLOAT_TYPES = {'float', 'double', 'long double'}
+_NUMPY_TYPES = {
+    'float': np.float32, 'double': np.float64, 'long double': np.longdouble,
+    'char': np.byte, 'signed char': np.byte, 'unsigned char': np.ubyte,
+    'short': np.short, 'unsigned short': np.ushort,
+    'int': np.intc, 'unsigned': np.uintc, 'unsigned int': np.uintc,
+    'long': np.int_, 'unsigned long': np.uint,
+    'long long': np.longlong, 'unsigned long long': np.ulonglong,
+    'int8_t': np.int8, 'int16_t': np.int16, 'int32_t': np.int32, 'int64_t': np.int64,
+    'uint8_t': np.uint8, 'uint16_t': np.uint16, 'uint32_t': np.uint32, 'uint64_t': np.uint64,
+    'size_t': np.uintp,
+}
+
+
+@dataclass
+class KernelParam:
+    """ kernel 函数的一个参数. 数组参数的 dims 为每一维的 C 表达式, 标量参数的 dims 为空. """
+    name: str
+    ctype: str
+    dims: List[str] = field(default_factory=list)
+
+    @property
+    def is_array(self) -> bool:
+        return len(self.dims) > 0
+
+    @property
+    def is_float(self) -> bool:
+        return self.ctype in _FLOAT_TYPES
+
+    @property
+    def dtype(self) -> np.dtype:
+        if self.ctype not in _NUMPY_TYPES:
+            raise ValueError(f"unsupported element type '{self.ctype}' of parameter '{self.name}'")
+        return np.dtype(_NUMPY_TYPES[self.ctype])
+
+    @property
+    def size(self) -> str:
+        """ 数组元素个数的 C 表达式. """
+        return ' * '.join(f"({d})" for d in self.dims)
+
+
+def _parse_param(param: str, sizes: Dict[str, str]) -> KernelParam:
+    m = re.match(r'^(.*?)(\(\s*\*\s*(\w+)\s*\)|\**\s*(\w+))\s*((?:\[[^\]]*\]\s*)*)$', param, flags=re.S)
+    if m is None:
+        raise ValueError(f"can not parse parameter '{param}'")
+    name = m.group(3) or m.group(4)
+    pointer = m.group(3) is not None or '*' in m.group(2)
+    ctype = ' '.join(w for w in m.group(1).replace('*', ' ').split() if w not in _QUALIFIERS)
+    dims = [' '.join(w for w in d.split() if w not in _QUALIFIERS)
+            for d in re.findall(r'\[([^\]]*)\]', m.group(5))]
+    if pointer:
+        dims.insert(0, '')
+    if name in sizes:
+        # 指针或者 `A[]` 这样缺少最外层大小的参数需要在 sizes 中给出.
+        dims = [sizes[name]] + dims[1:] if dims else [sizes[name]]
+    if any(d == '' for d in dims):
+        raise ValueError(f"size of parameter '{name}' is unknown, please give it in sizes")
+    return KernelParam(name, ctype, dims)
+
+
+def parse_signature(source: str, func_name: str, sizes: Optional[Dict[str, str]] = None) -> List[KernelParam]:
+    """ 解析 kernel 函数的参数列表.
+
+    :param sizes: 参数名 -> 最外层大小的 C 表达式, 用于指针参数, 例如 {'A': 'n * n'}.
+    """
+    (begin, end), _ = find_function(source, func_name)
+    return [_parse_param(p, sizes or {}) for p in split_params(source[begin:end])]
+
+
+KERNEL_PRELUDE = r'''#define _POSIX_C_SOURCE 200112L
+#include <stdio.h>
+#include <stdlib.h>
+#include <stdint.h>
+#include <string.h>
+#include <time.h>
+#include <math.h>
+#ifndef floord
+#define floord(n, d) (((n) < 0) ? -((-(n) + (d) - 1) / (d)) : (n) / (d))
+#endif
+#ifndef ceild
+#define ceild(n, d) (((n) < 0) ? -((-(n)) / (d)) : ((n) + (d) - 1) / (d))
+#endif
+#ifndef min
+#define min(x, y) ((x) < (y) ? (x) : (y))
+#endif
+#ifndef max
+#define max(x, y) ((x) > (y) ? (x) : (y))
+#endif
+#define main __bench_kernel_main
+'''
+
+
+def make_driver(kernel_path: str, func_name: str, params: List[KernelParam], align: int = 64) -> str:
+    """ 生成计时用的 main 函数. 标量参数按顺序从命令行读入, 之后依次是 runs, warmup, seed
+    以及可选的输出文件.
+
+    每次运行前都用同一个种子重新初始化所有数组, 每次运行的耗时 (秒) 单独输出一行.
+    给出输出目录时, 最后一次运行结束后把每个数组的原始字节写入该目录下的 <参数名>.bin.
+    """
+    scalars = [p for p in params if not p.is_array]
+    arrays = [p for p in params if p.is_array]
+    # driver 中的标识符都带有 __bench_ 前缀, 避免与 kernel 的函数名和参数名冲突.
+    lines = [KERNEL_PRELUDE + f'#include "{kernel_path}"', '#undef main', '',
+             'static uint64_t __bench_lcg_state;', '',
+             'static double __bench_next_random(void) {',
+             '  __bench_lcg_state = __bench_lcg_state * 6364136223846793005ULL + 1442695040888963407ULL;',
+             '  return (double)(__bench_lcg_state >> 11) / 9007199254740992.0;',
+             '}', '',
+             'int main(int __bench_argc, char **__bench_argv) {',
+             f'  if (__bench_argc != {len(scalars) + 4} && __bench_argc != {len(scalars) + 5}) {{',
+             f'    fprintf(stderr, "usage: %s {" ".join(p.name for p in scalars)} runs warmup seed [dump]\\n", __bench_argv[0]);',
+             '    return 2;', '  }']
+    for i, p in enumerate(scalars):
+        conv = 'strtod' if p.is_float else 'strtoll'
+        extra = '' if p.is_float else ', 10'
+        lines.append(f'  {p.ctype} {p.name} = ({p.ctype}){conv}(__bench_argv[{i + 1}], NULL{extra});')
+    n = len(scalars)
+    lines += [f'  int __bench_runs = atoi(__bench_argv[{n + 1}]);',
+              f'  int __bench_warmup = atoi(__bench_argv[{n + 2}]);',
+              f'  uint64_t __bench_seed = strtoull(__bench_argv[{n + 3}], NULL, 10);',
+              f'  const char *__bench_dump = __bench_argc > {n + 4} ? __bench_argv[{n + 4}] : NULL;']
+    for p in arrays:
+        lines += [f'  size_t __bench_size_{p.name} = (size_t)({p.size});',
+                  f'  {p.ctype} *{p.name} = NULL;',
+                  f'  if (posix_memalign((void **)&{p.name}, {align}, __bench_size_{p.name} * sizeof({p.ctype}) + 1) != 0) {{',
+                  f'    fprintf(stderr, "can not allocate {p.name}\\n");',
+                  '    return 1;', '  }']
+    # 通过 volatile 函数指针调用, 防止编译器把 kernel 内联进来之后删掉没有被读取的写操作.
+    call_args = ', '.join(p.name if not p.is_array else f'(void *){p.name}' for p in params)
+    lines += [f'  __typeof__({func_name}) *volatile __bench_fn = {func_name};',
+              '  for (int __bench_r = 0; __bench_r < __bench_warmup + __bench_runs; ++__bench_r) {',
+              '    __bench_lcg_state = __bench_seed;']
+    for p in arrays:
+        scale = '' if p.is_float else ' * 100'
+        lines.append(f'    for (size_t __bench_k = 0; __bench_k < __bench_size_{p.name}; ++__bench_k) '
+                     f'{p.name}[__bench_k] = ({p.ctype})(__bench_next_random(){scale});')
+    lines += ['    struct timespec __bench_t0, __bench_t1;',
+              '    clock_gettime(CLOCK_MONOTONIC, &__bench_t0);',
+              f'    __bench_fn({call_args});',
+              '    clock_gettime(CLOCK_MONOTONIC, &__bench_t1);',
+              '    if (__bench_r >= __bench_warmup)',
+              '      printf("%.9f\\n", (double)(__bench_t1.tv_sec - __bench_t0.tv_sec) + '
+              '(double)(__bench_t1.tv_nsec - __bench_t0.tv_nsec) * 1e-9);',
+              '  }']
+    if arrays:
+        lines += ['  if (__bench_dump != NULL) {',
+                  '    char __bench_path[4096];',
+                  '    FILE *__bench_out;']
+        for p in arrays:
+            lines += [f'    snprintf(__bench_path, sizeof(__bench_path), "%s/{p.name}.bin", __bench_dump);',
+                      '    if ((__bench_out = fopen(__bench_path, "wb")) == NULL) {',
+                      '      perror(__bench_path);',
+                      '      return 1;', '    }',
+                      f'    fwrite({p.name}, sizeof({p.ctype}), __bench_size_{p.name}, __bench_out);',
+                      '    fclose(__bench_out);']
+        lines += ['  }']
+    lines += [f'  free({p.name});' for p in arrays]
+    lines += ['  return 0;', '}', '']
+    return '\n'.join(lines)
+
+
+def compile_kernel(source: str, func_name: str, workdir: str, name: str,
+                   params: List[KernelParam], cc: Optional[str] = None,
+                   flags: Optional[Sequence[str]] = None) -> str:
+    """ 把 kernel 源码和 driver 写入 workdir 并编译, 返回可执行文件路径. """
+    cc = cc or os.environ.get('CC', 'cc')
+    flags = list(DEFAULT_FLAGS if flags is None else flags)
+    if '#pragma omp' in source and not any(f.startswith('-fopenmp') for f in flags):
+        flags.append('-fopenmp')
+    kernel_path = os.path.join(workdir, name + '_kernel.c')
+    driver_path = os.path.join(workdir, name + '_driver.c')
+    exe_path = os.path.join(workdir, name)
+    with open(kernel_path, 'w') as f:
+        f.write(source)
+    with open(driver_path, 'w') as f:
+        f.write(make_driver(os.path.basename(kernel_path), func_name, params))
+    cmd = [cc, '-std=gnu11', *flags, '-o', exe_path, driver_path, '-lm']
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"failed to compile {name}: {' '.join(cmd)}\n{proc.stderr}")
+    return exe_path
+
+
+def run_kernel(exe: str, params: List[KernelParam], values: Dict[str, float],
+               runs: int = 10, warmup: int = 2, seed: int = 42, dump: Optional[str] = None) -> List[float]:
+    """ 运行编译好的 driver, 返回每次运行的耗时 (秒). dump 见 make_driver. """
+    args = [str(values[p.name]) for p in params if not p.is_array] + [str(runs), str(warmup), str(seed)]
+    if dump is not None:
+        args.append(dump)
+    proc = subprocess.run([exe, *args],
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"{exe} exited with {proc.returncode}\n{proc.stderr}")
+    return [float(t) for t in proc.stdout.split()]
+
+
+@dataclass
+class BenchResult:
+    name: str
+    times: List[float]
+    median: float
+    mean: float
+    variance: float
+    min: float
+    throughput: Optional[float] = None
+    speedup: Optional[float] = None
+    correct: Optional[bool] = None
+    max_error: Optional[float] = None
+    mismatches: List[str] = field(default_factory=list)
+
+    @staticmethod
+    def from_times(name: str, times: List[float], work: Optional[float] = None) -> 'BenchResult':
+        median = statistics.median(times)
+        return BenchResult(name=name, times=times, median=median,
+                           mean=statistics.fmean(times),
+                           variance=statistics.variance(times) if len(times) > 1 else 0.0,
+                           min=min(times),
+                           throughput=work / median if work is not None and median > 0 else None)
+
+
+def load_dump(path: str, params: List[KernelParam]) -> Dict[str, np.ndarray]:
+    """ 读取 driver 输出到目录 path 中的数组, 返回 参数名 -> 一维数组. """
+    return {p.name: np.fromfile(os.path.join(path, p.name + '.bin'), dtype=p.dtype)
+            for p in params if p.is_array}
+
+
+def compare_arrays(expected: Dict[str, np.ndarray], actual: Dict[str, np.ndarray],
+                   rtol: Optional[float] = None, atol: float = 0.0) -> Tuple[List[str], float]:
+    """ 逐个比较数组. 整数数组和 rtol 为 None 时按位比较, 否则浮点数组用 numpy.isclose 比较.
+
+    :return: 不一致的数组名列表, 以及浮点数组的最大绝对误差.
+    """
+    mismatches, max_error = [], 0.0
+    for name, a in expected.items():
+        b = actual[name]
+        if a.shape != b.shape:
+            mismatches.append(name)
+            continue
+        if np.issubdtype(a.dtype, np.floating):
+            with np.errstate(invalid='ignore', over='ignore'):
+                diff = np.abs(a.astype(np.float64) - b.astype(np.float64))
+            if diff.size:
+                max_error = max(max_error, float(np.nanmax(diff)) if not np.isnan(diff).all() else 0.0)
+            if rtol is None:
+                ok = a.tobytes() == b.tobytes()
+            else:
+                ok = bool(np.all(np.isclose(b, a, rtol=rtol, atol=atol, equal_nan=True)))
+        else:
+            ok = np.array_equal(a, b)
+        if not ok:
+            mismatches.append(name)
+    return mismatches, max_error
+
+
+def benchmark(source: str, func_name: str, variants: Dict[str, CSource], values: Dict[str, float],
+              runs: int = 10, warmup: int = 2, seed: int = 42, work: Optional[float] = None,
+              region: int = 0, restrict: bool = False, sizes: Optional[Dict[str, str]] = None,
+              cc: Optional[str] = None, flags: Optional[Sequence[str]] = None,
+              json_path: Optional[str] = None, workdir: Optional[str] = None,
+              check: bool = False, rtol: Optional[float] = None, atol: float = 0.0) -> pandas.DataFrame:
+    """ 编译并计时原始 kernel 和每个变换后的版本.
+
+    :param source: 包含 kernel 函数的 C 源码, 原样作为 'original' 版本.
+    :param variants: 名字 -> CodeGenerator / schedule_to_code 生成的循环代码, 替换第 region 个 scop 区域.
+    :param values: 标量参数 (例如 N, T) 的取值.
+    :param work: 每次运行的工作量 (例如浮点运算次数), 给出时计算 throughput = work / median.
+    :param restrict: 为所有版本的数组参数加上 restrict.
+    :param sizes: 见 parse_signature.
+    :param flags: 编译选项, 默认为 DEFAULT_FLAGS; 代码中含有 omp pragma 时自动加上 -fopenmp.
+    :param json_path: 同时把结果写成 JSON.
+    :param workdir: 保存生成的源码和可执行文件的目录, 默认使用临时目录并在结束后删除.
+    :param check: 在同一次运行中检查正确性: 所有版本使用相同的随机输入, 最后一次运行后的
+                  数组与原始版本逐个比较, 结果记录在 correct / max_error / mismatches 列中.
+    :param rtol, atol: 浮点数组的容差, rtol 为 None 时按位比较.
+    """
+    params = parse_signature(source, func_name, sizes)
+    sources = {'original': restrict_array_params(source, func_name) if restrict else source}
+    for name, code in variants.items():
+        sources[name] = kernel_source(source, func_name, code, region=region, restrict=restrict).context
+    tmpdir = workdir or tempfile.mkdtemp(prefix='isl_learn_bench_')
+    os.makedirs(tmpdir, exist_ok=True)
+    try:
+        results = []
+        expected = None
+        for name, text in sources.items():
+            exe = compile_kernel(text, func_name, tmpdir, re.sub(r'\W', '_', name), params, cc, flags)
+            dump = None
+            if check:
+                dump = exe + '_out'
+                os.makedirs(dump, exist_ok=True)
+            result = BenchResult.from_times(name, run_kernel(exe, params, values, runs, warmup, seed, dump), work)
+            if check:
+                arrays = load_dump(dump, params)
+                if expected is None:
+                    expected = arrays
+                result.mismatches, result.max_error = compare_arrays(expected, arrays, rtol, atol)
+                result.correct = len(result.mismatches) == 0
+            results.append(result)
+    finally:
+        if workdir is None:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+    for r in results:
+        r.speedup = results[0].median / r.median if r.median > 0 else None
+    if json_path is not None:
+        with open(json_path, 'w') as f:
+            json.dump({'func_name': func_name, 'values': values, 'runs': runs, 'warmup': warmup,
+                       'cc': cc or os.environ.get('CC', 'cc'),
+                       'flags': list(DEFAULT_FLAGS if flags is None else flags),
+                       'results': [asdict(r) for r in results]}, f, indent=2)
+    table = pandas.DataFrame([asdict(r) for r in results]).drop(columns='times').set_index('name')
+    if not check:
+        table = table.drop(columns=['correct', 'max_error', 'mismatches'])
+    return table
+
+
+def best_variant(table: pandas.DataFrame) -> str:
+    """ 返回 benchmark(check=True) 结果中最快的正确版本, 错误的版本不论多快都不会被选中.
+    没有正确版本时抛出 ValueError 并列出全部失败的版本. """
+    if 'correct' not in table.columns:
+        raise ValueError("table has no correctness results, run benchmark with check=True")
+    correct = table[table['correct'] == True]  # noqa: E712
+    if len(correct) == 0:
+        failed = ', '.join(str(name) for name in table.index)
+        raise ValueError(f"no variant produced the reference result, failing variants: {failed}")
+    return correct['median'].idxmin()
@@ -1,14 +1,31 @@
 import isl
 import pet
+import os
+import re
+import itertools
 import pandas
+import tempfile
+import threading
 import numpy as np
-from typing import Callable, Union
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, TextIO, Tuple, Union
+
+# isl 的 python binding 共享同一个 isl_ctx, 多线程调用时需要串行.
+isl_lock = threading.RLock()
+
+# 所有 band 使用同一个大小, 按成员给出大小, 或者由 band 决定大小(返回 None 表示不做 tiling).
+TileSizes = Union[int, Sequence[int], Callable[[isl.schedule_node_band], Optional[Sequence[int]]]]
 
 
 class CSource():
-    def __init__(self, path: str) -> None:
-        with open(path, 'r') as f:
-            self.context = f.read()
+    def __init__(self, path: str = None, context: str = None) -> None:
+        if context is None:
+            with open(path, 'r') as f:
+                context = f.read()
+        self.context = context
+
+    @staticmethod
+    def from_str(context: str) -> 'CSource':
+        return CSource(context=context)
 
     def _repr_html_(self) -> str:
         return "<pre class='code'><code class=\"cpp hljs\">" + self.context + "</code></pre>"
@@ -21,111 +38,754 @@ class CSource():
 
 
 class CodeGenerator:
-    def __init__(self, scop: pet.scop, schedule: isl.schedule, custom_pullback=None) -> None:
+    def __init__(self, scop: pet.scop, schedule: isl.schedule, custom_pullback=None,
+                 openmp: bool = False, tile_sizes: Optional[TileSizes] = None,
+                 simd: Union[bool, str] = False, simd_align: Optional[int] = None) -> None:
+        """
+        :param openmp: 根据 band 的 coincident 标记, 为每个循环嵌套中最外层的并行循环
+                       生成 `#pragma omp parallel for`. schedule 需要由调度器计算得到, 例如 compute_schedule.
+        :param tile_sizes: 在生成 ast 之前对所有 permutable 的 band 做 tiling, 见 tile_schedule.
+        :param simd: 为没有循环携带依赖且访存步长为 1 的最内层循环生成 `#pragma omp simd`,
+                     取值 'ivdep' 时生成 `#pragma GCC ivdep`.
+        :param simd_align: 数组按该字节数对齐时, 在 omp simd 上添加 aligned 子句.
+        """
         self.scop = scop
         self.schedule = schedule
+        self.openmp = openmp
+        self.tile_sizes = tile_sizes
+        self.simd = simd
+        self.simd_align = simd_align
         self.custom_pullback: Callable[[isl.multi_pw_aff, isl.id,
                                         isl.pw_multi_aff], isl.multi_pw_aff] = custom_pullback
+        self._stmt_index: Dict[int, pet.stmt] = None
+        # stmt id ptr -> { iterator map text -> ref2expr }, 只在一次 generate 内有效,
+        # 其中的表达式依赖该次生成的 build.
+        self._ref2expr_cache: Dict[int, Dict[str, object]] = {}
 
-    def generate(self):
-        def find_stmt_from_scop(id: isl.id) -> pet.stmt:
-            """ 在pet解析的scop中找到对应的stmt.  """
-            n_stmt = self.scop.get_n_stmt()
-            for i in range(n_stmt):
-                stmt = self.scop.get_stmt(i)
-                domain = stmt.get_domain()
-                id_i = domain.get_tuple_id()
-                if (id.ptr == id_i.ptr):
-                    return stmt
+    def stmt_index(self) -> Dict[int, pet.stmt]:
+        """ 按 tuple id 建立 scop 中 stmt 的索引, 每个 scop 只构建一次. """
+        if self._stmt_index is None:
+            self._stmt_index = build_stmt_index(self.scop)
+        return self._stmt_index
 
-        id_dict = dict()
+    def generate(self, sink: Optional[TextIO] = None) -> Optional[CSource]:
+        """ 生成 C 代码. 给定 sink 时按顶层节点逐块写入 sink 并返回 None. """
+        with isl_lock:
+            return self._generate(sink)
+
+    def _generate(self, sink: Optional[TextIO]) -> Optional[CSource]:
+        self._ref2expr_cache.clear()
+        stmt_index = self.stmt_index()
+        leaves: List[Tuple[pet.stmt, isl.id_to_ast_expr]] = []
+        # mark 名称 -> 需要打印在对应 for 循环之前的 pragma.
+        pragmas: Dict[str, List[str]] = {}
+        schedule = self.schedule
+        if self.tile_sizes is not None:
+            schedule = tile_schedule(schedule, self.tile_sizes)
+        if self.simd:
+            schedule = mark_simd_loops(schedule, self.scop, pragmas,
+                                       'ivdep' if self.simd == 'ivdep' else 'omp', self.simd_align)
+        if self.openmp:
+            schedule = mark_parallel_loops(schedule, self.scop, pragmas)
 
         def at_each_domain(node: isl.ast_node_user, build: isl.ast_build):
             expr: isl.ast_expr_op = node.get_expr()
             arg: isl.ast_expr_id = expr.get_arg(0)
             id: isl.id = arg.get_id()
-            stmt: pet.stmt = find_stmt_from_scop(id)
+            stmt: pet.stmt = stmt_index[id.ptr]
             map = build.get_schedule().as_map()
             map = map.reverse()
             iterator_map = map.as_pw_multi_aff()
 
-            def pullback_index(index: isl.multi_pw_aff, id: isl.id):
-                if self.custom_pullback:
-                    return self.custom_pullback(index, id, iterator_map)
-                return index.pullback(iterator_map)
+            # the same statement can appear in several leaves, reuse the
+            # expressions when it is scheduled through the same iterators.
+            cache = self._ref2expr_cache.setdefault(id.ptr, {})
+            key = str(iterator_map)
+            ref2expr = cache.get(key)
+            if ref2expr is None:
+                def pullback_index(index: isl.multi_pw_aff, id: isl.id):
+                    if self.custom_pullback:
+                        return self.custom_pullback(index, id, iterator_map)
+                    return index.pullback(iterator_map)
 
-            ref2expr = stmt.build_ast_exprs(build, pullback_index, None)
-            id_dict[id.ptr] = (stmt, ref2expr)
+                ref2expr = stmt.build_ast_exprs(build, pullback_index, None)
+                cache[key] = ref2expr
 
-            return node.set_annotation(id)
+            # annotate every leaf separately, the statement id is shared by
+            # all leaves of the same statement.
+            leaves.append((stmt, ref2expr))
+            return node.set_annotation(isl.id(f"{id.name()}@{len(leaves) - 1}"))
 
         def print_user(p: isl.printer, opt: isl.ast_print_options, node: isl.ast_node_user):
             # when loop can parallel execute:
             id = node.annotation()
-            (stmt, ref2expr) = id_dict[id.ptr]
+            (stmt, ref2expr) = leaves[int(id.name().rsplit('@', 1)[1])]
             p = stmt.print_body(p, ref2expr)
             return p
 
-        printer = isl.printer.from_file('/tmp/generated.c')
-        printer.set_output_format(isl.ISL_FORMAT.C)
+        def after_mark(node: isl.ast_node_mark, build: isl.ast_build) -> isl.ast_node:
+            name = node.id().name()
+            if name not in pragmas:
+                return node
+            mark_child: isl.ast_node = _annotate_loop(node.node(), name)
+            # NOTE isl内部应该有bug,如果root节点为ast for, 那么后续遍历时无法遍历到root for ast node. 所以这里手动添加一个block
+            return isl.ast_node_block(isl.ast_node_list(isl.ast_node(mark_child)))
+
+        # 只为每个循环嵌套中最外层的并行循环生成 omp parallel.
+        parallel_depth = [0]
+
+        def print_for(p: isl.printer, opt: isl.ast_print_options, node: isl.ast_node_for):
+            anno = node.get_annotation()
+            names = anno.name().split('|') if anno.ptr is not None else []
+            parallel = False
+            for name in names:
+                for line in pragmas.get(name, []):
+                    if line.startswith('#pragma omp parallel'):
+                        if parallel_depth[0] > 0 or parallel:
+                            continue
+                        parallel = True
+                    elif line.startswith('#pragma omp simd') and parallel:
+                        # 同一个循环不能同时带 parallel for 和 simd 两条 pragma, 以并行为准.
+                        continue
+                    p.start_line()
+                    p.print_str(line)
+                    p.end_line()
+            if parallel:
+                parallel_depth[0] += 1
+            node.print(p, opt)
+            if parallel:
+                parallel_depth[0] -= 1
+            return p
+
         builder = isl.ast_build()
         builder = builder.set_at_each_domain(at_each_domain)
-        tree: isl.ast_node = builder.node_from(self.schedule)
+        if pragmas:
+            builder = builder.set_after_each_mark(after_mark)
+        tree: isl.ast_node = builder.node_from(schedule)
         options = isl.ast_print_options.alloc()
         options = options.set_print_user(print_user)
-        tree.print(printer, options)
-        printer.flush()
+        if pragmas:
+            options = options.set_print_for(print_for)
+        return print_ast(tree, options, sink)
+
+
+def _band_tile_sizes(band: isl.schedule_node_band, tile_sizes: TileSizes) -> Optional[List[int]]:
+    if callable(tile_sizes):
+        tile_sizes = tile_sizes(band)
+        if tile_sizes is None:
+            return None
+    sizes = [tile_sizes] if isinstance(tile_sizes, int) else list(tile_sizes)
+    n = band.n_member()
+    # 成员数多于给出的大小时, 重复使用最后一个大小.
+    return (sizes + sizes[-1:] * n)[:n]
+
+
+def tile_band(band: isl.schedule_node_band, sizes: Sequence[int]) -> isl.schedule_node:
+    mv = isl.multi_val.zero(band.space())  # 通过aff的space构造multi value, 保证match aff的space.
+    for i, size in enumerate(sizes):
+        mv = mv.set_at(i, isl.val(str(size)))
+    return band.tile(mv)
+
+
+def tile_schedule(schedule: isl.schedule, tile_sizes: TileSizes) -> isl.schedule:
+    """ 对 schedule tree 中所有 permutable 的 band 做 tiling. """
+    def tile(node: isl.schedule_node) -> isl.schedule_node:
+        if not isinstance(node, isl.schedule_node_band):
+            return node
+        band: isl.schedule_node_band = node
+        if band.n_member() == 0 or not band.get_permutable():
+            return node
+        sizes = _band_tile_sizes(band, tile_sizes)
+        if sizes is None:
+            return node
+        return tile_band(band, sizes)
+
+    # post order visit
+    return schedule.map_schedule_node_bottom_up(tile)
+
+
+def _annotate_loop(node: isl.ast_node, name: str) -> isl.ast_node:
+    """ 将 mark 名称记录在 mark 下第一个 for 节点的 annotation 中, 多个 mark 用 '|' 连接. """
+    if isinstance(node, isl.ast_node_block):
+        children: isl.ast_node_list = node.children()
+        if children.size() != 1:
+            return node
+        child = _annotate_loop(children.at(0), name)
+        return isl.ast_node_block(isl.ast_node_list(isl.ast_node(child)))
+    if isinstance(node, isl.ast_node_for):
+        anno = node.get_annotation()
+        if anno.ptr is not None:
+            name = name + '|' + anno.name()
+        return node.set_annotation(isl.id(name))
+    return node
+
+
+def _insert_pragma_mark(band: isl.schedule_node_band, member: int, lines: List[str],
+                        pragmas: Dict[str, List[str]]) -> isl.schedule_node:
+    """ 将 band 的第 member 个成员拆分为单独的 band, 并在其前插入 mark.
+
+    返回的节点与输入的 band 位于 schedule tree 中的同一位置.
+    """
+    node = band
+    if member > 0:
+        node = node.split(member).child(0)
+    if node.n_member() > 1:
+        node = node.split(1)
+    name = f"pragma_{len(pragmas)}"
+    pragmas[name] = lines
+    node = node.insert_mark(isl.id(name))
+    if member > 0:
+        node = node.parent()
+    return node
+
+
+def scalar_arrays(access: isl.union_map) -> isl.union_set:
+    """ 访问关系中零维的数组, 即标量. """
+    scalars = isl.union_set.empty(access.get_space())
+    ranges: isl.set_list = access.range().set_list()
+    for i in range(ranges.size()):
+        s: isl.set = ranges.at(i)
+        if s.dim(isl.ISL_DIM_TYPE.SET) == 0:
+            scalars = scalars.union(isl.union_set(s))
+    return scalars
+
+
+def _private_clause(scop: pet.scop, domain: isl.union_set) -> str:
+    """ 循环内写入的标量需要私有化, 循环之后还会被读取的标量使用 lastprivate. """
+    written = scalar_arrays(scop.get_may_writes().intersect_domain(domain))
+    read_after = scop.get_may_reads().subtract_domain(domain).range()
+    private, lastprivate = [], []
+    lst: isl.set_list = written.set_list()
+    for i in range(lst.size()):
+        s: isl.set = lst.at(i)
+        name = s.get_tuple_name()
+        if isl.union_set(s).intersect(read_after).is_empty():
+            private.append(name)
+        else:
+            lastprivate.append(name)
+    clause = ''
+    if private:
+        clause += f" private({', '.join(sorted(private))})"
+    if lastprivate:
+        clause += f" lastprivate({', '.join(sorted(lastprivate))})"
+    return clause
+
+
+def mark_parallel_loops(schedule: isl.schedule, scop: pet.scop,
+                        pragmas: Dict[str, List[str]]) -> isl.schedule:
+    """ 在每个 band 的第一个 coincident 成员之前插入 omp parallel for 的 mark. """
+    def mark(node: isl.schedule_node) -> isl.schedule_node:
+        if not isinstance(node, isl.schedule_node_band):
+            return node
+        band: isl.schedule_node_band = node
+        for i in range(band.n_member()):
+            if band.member_get_coincident(i):
+                line = "#pragma omp parallel for" + _private_clause(scop, band.get_domain())
+                return _insert_pragma_mark(band, i, [line], pragmas)
+        return node
+
+    # post order visit
+    return schedule.map_schedule_node_bottom_up(mark)
+
+
+def _has_band_descendant(node: isl.schedule_node) -> bool:
+    for i in range(node.n_children()):
+        child = node.child(i)
+        if isinstance(child, isl.schedule_node_band) or _has_band_descendant(child):
+            return True
+    return False
+
+
+def _is_loop_carried(deps: isl.union_map, loops: isl.union_map, depth: int) -> bool:
+    """ 依赖在 loops 的最后一维上是否有非零距离, 而外层维度距离为零. """
+    pairs: isl.union_map = deps.apply_domain(loops).apply_range(loops)
+    zeros = ''.join('0, ' for _ in range(depth - 1))
+    carried = isl.union_set(f"{{ [{zeros}t] : t < 0 or t > 0 }}")
+    return not pairs.deltas().intersect(carried).is_empty()
 
-        return CSource('/tmp/generated.c')
+
+def _is_unit_stride(accesses: isl.union_map, loops: isl.union_map, depth: int) -> bool:
+    """ 最内层循环前进一次时, 每个访问的数组下标只在最后一维上前进 0 或 1. """
+    outer = ', '.join(f"o{i}" for i in range(depth - 1))
+    sep = ', ' if depth > 1 else ''
+    step = isl.union_map(f"{{ [{outer}{sep}t] -> [{outer}{sep}t + 1] }}")
+    succ = loops.apply_range(step).apply_range(loops.reverse())
+    # 每个引用单独检查, 同一语句中对同一数组的两个不同引用不能相互比较.
+    lst: isl.map_list = accesses.map_list()
+    for i in range(lst.size()):
+        access: isl.map = lst.at(i).domain_factor_domain()
+        n = access.dim(isl.ISL_DIM_TYPE.OUT)
+        if n == 0:
+            continue
+        access = isl.union_map(access)
+        deltas = succ.apply_domain(access).apply_range(access).deltas()
+        name = lst.at(i).get_tuple_name(isl.ISL_DIM_TYPE.OUT)
+        zeros = ''.join('0, ' for _ in range(n - 1))
+        allowed = isl.union_set(f"{{ {name}[{zeros}d] : 0 <= d <= 1 }}")
+        if not deltas.is_subset(allowed):
+            return False
+    return True
+
+
+def mark_simd_loops(schedule: isl.schedule, scop: pet.scop, pragmas: Dict[str, List[str]],
+                    kind: str = 'omp', align: Optional[int] = None) -> isl.schedule:
+    """ 在没有循环携带依赖, 且访存步长为 1 的最内层循环前插入 simd 的 mark. """
+    raw, _, _ = compute_dependences(scop)
+    _, war, waw = compute_dependences(scop, exclude=scalar_arrays(scop.get_may_writes()))
+    deps = raw.union(war).union(waw)
+    tagged = scop.get_tagged_may_reads().union(scop.get_tagged_may_writes())
+
+    def mark(node: isl.schedule_node) -> isl.schedule_node:
+        if not isinstance(node, isl.schedule_node_band):
+            return node
+        band: isl.schedule_node_band = node
+        if band.n_member() == 0 or _has_band_descendant(band):
+            return node
+        domain = band.get_domain()
+        loops = band.get_prefix_schedule_union_map().flat_range_product(
+            band.get_partial_schedule_union_map().intersect_domain(domain))
+        if loops.is_empty():
+            return node
+        depth = loops.map_list().at(0).dim(isl.ISL_DIM_TYPE.OUT)
+        # tagged 访问关系的 domain 为 [S[i] -> ref[]], 只保留 band 中语句的引用.
+        refs = tagged.domain().unwrap().intersect_domain(domain).wrap()
+        accesses = tagged.intersect_domain(refs)
+        if _is_loop_carried(deps.intersect_domain(domain).intersect_range(domain), loops, depth):
+            return node
+        if not _is_unit_stride(accesses, loops, depth):
+            return node
+        if kind == 'ivdep':
+            line = "#pragma GCC ivdep"
+        else:
+            line = "#pragma omp simd" + _private_clause(scop, domain)
+            if align is not None:
+                lst: isl.map_list = accesses.map_list()
+                arrays = sorted({lst.at(i).get_tuple_name(isl.ISL_DIM_TYPE.OUT) for i in range(lst.size())
+                                 if lst.at(i).dim(isl.ISL_DIM_TYPE.OUT) > 0})
+                if arrays:
+                    line += f" aligned({', '.join(arrays)}: {align})"
+        return _insert_pragma_mark(band, band.n_member() - 1, [line], pragmas)
+
+    # post order visit
+    return schedule.map_schedule_node_bottom_up(mark)
+
+
+def build_stmt_index(scop: pet.scop) -> Dict[int, pet.stmt]:
+    """ 在pet解析的scop中建立 tuple id -> stmt 的索引.  """
+    index = dict()
+    for i in range(scop.get_n_stmt()):
+        stmt = scop.get_stmt(i)
+        index[stmt.get_domain().get_tuple_id().ptr] = stmt
+    return index
 
 
 def parse_code(source: str, func_name: str) -> pet.scop:
-    with open("/tmp/parse_code.c", "w") as f:
-        f.write(source)
-    scop = pet.scop.extract_from_C_source("/tmp/parse_code.c", func_name)
+    # 每次调用使用独立的临时文件, 并行调用时不会互相覆盖.
+    fd, path = tempfile.mkstemp(suffix='.c', prefix='parse_code_')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(source)
+        scop = pet.scop.extract_from_C_source(path, func_name)
+    finally:
+        os.remove(path)
     return scop
 
 
-def isl_mat_to_numpy(mat: isl.mat):
-    return np.array([[mat.get_element_val(i, j).get_num_si()
-                      for j in range(mat.cols())]
-                     for i in range(mat.rows())])
-
-
-def display_constraints(data: Union[isl.basic_map, isl.basic_set]):
-    if isinstance(data, isl.basic_map):
-        titles = bmap_dim_titles(data)
-        eqs = isl_mat_to_numpy(data.equalities_matrix(isl.ISL_DIM_TYPE.CST,
-                               isl.ISL_DIM_TYPE.PARAM,
-                               isl.ISL_DIM_TYPE.IN,
-                               isl.ISL_DIM_TYPE.OUT,
-                               isl.ISL_DIM_TYPE.DIV))
-        df_eq = pandas.DataFrame(eqs, columns=titles, index=[
-                                 '' for i in eqs]) if len(eqs) else None
-        ineqs = isl_mat_to_numpy(data.inequalities_matrix(isl.ISL_DIM_TYPE.CST,
-                                 isl.ISL_DIM_TYPE.PARAM,
-                                 isl.ISL_DIM_TYPE.IN,
-                                 isl.ISL_DIM_TYPE.OUT,
-                                 isl.ISL_DIM_TYPE.DIV))
-        df_ineq = pandas.DataFrame(ineqs, columns=titles, index=[
-                                   '' for i in ineqs]) if len(ineqs) else None
-        return (df_ineq, df_eq)
-    else:
-        titles = bset_dim_titles(data)
-
-        eqs = isl_mat_to_numpy(data.equalities_matrix(isl.ISL_DIM_TYPE.CST,
-                                                      isl.ISL_DIM_TYPE.PARAM,
-                                                      isl.ISL_DIM_TYPE.SET,
-                                                      isl.ISL_DIM_TYPE.DIV))
-        df_eq = pandas.DataFrame(eqs, columns=titles, index=[
-                                 '' for i in eqs]) if len(eqs) else None
-        ineqs = isl_mat_to_numpy(data.inequalities_matrix(isl.ISL_DIM_TYPE.CST,
-                                                          isl.ISL_DIM_TYPE.PARAM,
-                                                          isl.ISL_DIM_TYPE.SET,
-                                                          isl.ISL_DIM_TYPE.DIV))
-        df_ineq = pandas.DataFrame(ineqs, columns=titles, index=[
-                                   '' for i in ineqs]) if len(ineqs) else None
-        return (df_ineq, df_eq)
+def compute_dependences(scop: pet.scop, exclude: Optional[isl.union_set] = None
+                        ) -> Tuple[isl.union_map, isl.union_map, isl.union_map]:
+    """ 计算 scop 的写后读, 读后写, 写后写依赖.
+
+    :param exclude: 忽略这些数组上的读后写, 写后写依赖, 用于可以私有化的标量.
+    """
+    schedule = scop.get_schedule()
+    may_read = scop.get_may_reads()
+    may_write = scop.get_may_writes()
+    must_write = scop.get_must_writes()
+
+    access = isl.union_access_info(may_read)
+    access = access.set_may_source(may_write)
+    access = access.set_must_source(must_write)
+    access = access.set_schedule(schedule)
+    raw = access.compute_flow().get_may_dependence()
+
+    if exclude is not None:
+        may_read = may_read.subtract_range(exclude)
+        may_write = may_write.subtract_range(exclude)
+
+    access = isl.union_access_info(may_write)
+    access = access.set_may_source(may_read)
+    access = access.set_schedule(schedule)
+    war = access.compute_flow().get_may_dependence()
+
+    access = isl.union_access_info(may_write)
+    access = access.set_may_source(may_write)
+    access = access.set_schedule(schedule)
+    waw = access.compute_flow().get_may_dependence()
+    return (raw, war, waw)
+
+
+def compute_schedule(scop: pet.scop) -> isl.schedule:
+    """ 以全部依赖作为 validity/proximity 约束, 调用 isl 调度器.
+
+    标量上的读后写, 写后写依赖可以通过私有化消除, 因此不计入 coincidence 约束.
+    """
+    raw, war, waw = compute_dependences(scop)
+    dep = raw.union(war).union(waw)
+    scalars = scalar_arrays(scop.get_may_writes())
+    _, war_array, waw_array = compute_dependences(scop, exclude=scalars)
+    sc = isl.schedule_constraints.on_domain(scop.get_schedule().get_domain())
+    sc = sc.set_context(scop.get_context())
+    sc = sc.set_validity(dep)
+    sc = sc.set_coincidence(raw.union(war_array).union(waw_array))
+    sc = sc.set_proximity(dep)
+    return sc.compute_schedule()
+
+
+def _blank_comments(source: str) -> str:
+    """ 将注释和字符串替换为等长的空白, 保持偏移不变.  """
+    def blank(m: re.Match) -> str:
+        return re.sub(r'[^\n]', ' ', m.group(0))
+    return re.sub(r'/\*.*?\*/|//[^\n]*|"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'',
+                  blank, source, flags=re.S)
+
+
+def find_scop_functions(source: str) -> List[Tuple[str, int]]:
+    """ 扫描 C 源码, 按出现顺序返回含有 `#pragma scop` 的函数名以及其中 scop 的个数.  """
+    text = _blank_comments(source)
+    # 宏定义等预处理指令中的括号会干扰函数名的识别.
+    text = re.sub(r'^[ \t]*#(?![ \t]*pragma[ \t]+(?:end)?scop\b)[^\n]*', lambda m: ' ' * len(m.group(0)),
+                  text, flags=re.M)
+    functions: List[Tuple[str, int]] = []
+    depth = 0
+    start = 0
+    name = None
+    for m in re.finditer(r'[{};]|#\s*pragma\s+scop\b', text):
+        tok = m.group(0)
+        if tok == '{':
+            if depth == 0:
+                head = re.search(r'(\w+)\s*\(', text[start:m.start()])
+                name = head.group(1) if head else None
+            depth += 1
+        elif tok == '}':
+            depth = max(depth - 1, 0)
+            if depth == 0:
+                start = m.end()
+                name = None
+        elif tok == ';':
+            if depth == 0:
+                start = m.end()
+        elif name is not None:
+            if functions and functions[-1][0] == name:
+                functions[-1] = (name, functions[-1][1] + 1)
+            else:
+                functions.append((name, 1))
+    return functions
+
+
+def _match_close(text: str, start: int, open_c: str, close_c: str) -> int:
+    """ 返回与 text[start] 处括号匹配的右括号位置. """
+    depth = 0
+    for i in range(start, len(text)):
+        if text[i] == open_c:
+            depth += 1
+        elif text[i] == close_c:
+            depth -= 1
+            if depth == 0:
+                return i
+    raise ValueError(f"unbalanced '{open_c}' at offset {start}")
+
+
+def find_function(source: str, func_name: str) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+    """ 返回函数定义中参数列表 (括号内) 和函数体 (花括号内) 的偏移范围. """
+    text = _blank_comments(source)
+    for m in re.finditer(r'\b' + re.escape(func_name) + r'\s*\(', text):
+        lparen = m.end() - 1
+        rparen = _match_close(text, lparen, '(', ')')
+        body = re.match(r'\s*\{', text[rparen + 1:])
+        if body is None:
+            continue  # 声明或者调用
+        lbrace = rparen + body.end()
+        rbrace = _match_close(text, lbrace, '{', '}')
+        return ((lparen + 1, rparen), (lbrace + 1, rbrace))
+    raise ValueError(f"can not find the definition of function '{func_name}'")
+
+
+def split_params(params: str) -> List[str]:
+    """ 按顶层的逗号拆分参数列表. """
+    parts, depth, start = [], 0, 0
+    for i, c in enumerate(params):
+        if c in '([':
+            depth += 1
+        elif c in ')]':
+            depth -= 1
+        elif c == ',' and depth == 0:
+            parts.append(params[start:i])
+            start = i + 1
+    parts.append(params[start:])
+    return [p.strip() for p in parts if p.strip() and p.strip() != 'void']
+
+
+def _restrict_param(param: str) -> str:
+    if '[' in param:
+        i = param.index('[')
+        if 'restrict' in param[i:param.index(']', i)]:
+            return param
+        return param[:i + 1] + 'restrict ' + param[i + 1:]
+    if '*' in param and '(' not in param and 'restrict' not in param:
+        i = param.rindex('*')
+        return param[:i + 1] + 'restrict ' + param[i + 1:].lstrip()
+    return param
+
+
+def restrict_array_params(source: str, func_name: str) -> str:
+    """ 为函数的数组和指针参数加上 restrict, 例如 `float A[N]` -> `float A[restrict N]`. """
+    (begin, end), _ = find_function(source, func_name)
+    params = ', '.join(_restrict_param(p) for p in split_params(source[begin:end]))
+    return source[:begin] + params + source[end:]
+
+
+_SCOP_REGION = re.compile(r'^[ \t]*#[ \t]*pragma[ \t]+scop\b.*?^[ \t]*#[ \t]*pragma[ \t]+endscop\b[^\n]*',
+                          flags=re.M | re.S)
+
+
+def kernel_source(source: str, func_name: str, code: CSource, region: int = 0,
+                  restrict: bool = True) -> CSource:
+    """ 用生成的代码替换函数中第 region 个 `#pragma scop` 区域, 得到完整的 kernel 源码.
+
+    :param restrict: 为数组参数加上 restrict, 便于编译器向量化.
+    """
+    _, (begin, end) = find_function(source, func_name)
+    text = _blank_comments(source)
+    scops = list(_SCOP_REGION.finditer(text[begin:end]))
+    if region >= len(scops):
+        raise ValueError(f"function '{func_name}' has only {len(scops)} scop regions")
+    m = scops[region]
+    result = source[:begin + m.start()] + code.context.rstrip('\n') + source[begin + m.end():]
+    if restrict:
+        result = restrict_array_params(result, func_name)
+    return CSource.from_str(result)
+
+
+def _scop_regions(source: str) -> List[Tuple[Tuple[str, int], int, int]]:
+    """ 按出现顺序返回每个 `#pragma scop` 区域的 ((函数名, region 序号), 起始偏移, 结束偏移). """
+    text = _blank_comments(source)
+    regions = []
+    for name, _ in find_scop_functions(source):
+        _, (begin, end) = find_function(source, name)
+        for i, m in enumerate(_SCOP_REGION.finditer(text[begin:end])):
+            regions.append(((name, i), begin + m.start(), begin + m.end()))
+    return regions
+
+
+def _select_scop_region(source: str, regions: List[Tuple[Tuple[str, int], int, int]],
+                        key: Tuple[str, int]) -> str:
+    """ 把同一函数中 key 之前的区域的 pragma 行替换为等长空白, 使 pet 提取的第一个 scop 就是 key. """
+    name, index = key
+    chars = list(source)
+    for (func, i), start, stop in regions:
+        if func != name or i >= index:
+            continue
+        first_end = source.index('\n', start)
+        last_start = source.rindex('\n', start, stop) + 1
+        for pos in list(range(start, first_end)) + list(range(last_start, stop)):
+            chars[pos] = ' '
+    return ''.join(chars)
+
+
+def iter_scops(source: str) -> Iterator[Tuple[Tuple[str, int], pet.scop]]:
+    """ 按出现顺序惰性返回翻译单元中每个 scop 区域的 ((函数名, region 序号), scop).
+
+    binding 只导出 extract_from_C_source, 它返回指定函数中的第一个 scop. 这里先扫描出所有区域,
+    源码只写入一次临时文件; 函数中后面的区域把之前区域的 pragma 替换为空白后再提取.
+    key 来自区域本身, pet 拒绝某个区域时只跳过这个区域, 不影响其它 scop 的 key.
+    每次提取都持有 isl_lock, 调用者在两次提取之间处理当前 scop.
+    """
+    regions = _scop_regions(source)
+    fd, path = tempfile.mkstemp(suffix='.c', prefix='iter_scops_')
+    with os.fdopen(fd, 'w') as f:
+        f.write(source)
+    try:
+        for key, _, _ in regions:
+            name, index = key
+            with isl_lock:
+                if index == 0:
+                    scop = pet.scop.extract_from_C_source(path, name)
+                else:
+                    scop = parse_code(_select_scop_region(source, regions, key), name)
+            if scop is not None:
+                yield (key, scop)
+    finally:
+        os.remove(path)
+
+
+def extract_all_scops(source: str) -> Dict[Tuple[str, int], pet.scop]:
+    """ 一次解析提取翻译单元中的全部 scop, 以 (函数名, region 序号) 为 key. """
+    return dict(iter_scops(source))
+
+
+def _rows_to_numpy(rows: List[List[int]], cols: int) -> np.ndarray:
+    """ 放入 int64 数组, 有系数超出 int64 范围时改用 dtype=object, 保证数值精确. """
+    if len(rows) == 0:
+        return np.zeros((0, cols), dtype=np.int64)
+    lo, hi = np.iinfo(np.int64).min, np.iinfo(np.int64).max
+    if all(lo <= v <= hi for row in rows for v in row):
+        return np.array(rows, dtype=np.int64).reshape(len(rows), cols)
+    return np.array(rows, dtype=object).reshape(len(rows), cols)
+
+
+def _to_sparse(out: np.ndarray):
+    if out.dtype == object:
+        raise ValueError("coefficients do not fit into int64, can not build a sparse matrix")
+    import scipy.sparse
+    return scipy.sparse.csr_matrix(out)
+
+
+def isl_mat_to_numpy(mat: isl.mat, sparse: bool = False):
+    """ 将 isl.mat 读入 int64 数组, 系数超出 int64 范围时返回 dtype=object 的数组.
+
+    binding 只能逐个元素读取 isl.mat, 每个元素一次 get_element_val 和一次文本转换,
+    不依赖 get_num_si 在溢出时的返回值. 对 basic set/map 的约束矩阵应使用
+    constraint_matrices_to_numpy, 它一次调用读出全部系数.
+
+    :param sparse: 返回 scipy.sparse.csr_matrix, 适合非常稀疏的约束系统.
+    """
+    rows, cols = mat.rows(), mat.cols()
+    get = mat.get_element_val
+    out = _rows_to_numpy([[int(str(get(i, j))) for j in range(cols)] for i in range(rows)], cols)
+    return _to_sparse(out) if sparse else out
+
+
+def constraint_matrices_to_numpy(data: Union[isl.basic_set, isl.basic_map], types=None,
+                                 sparse: bool = False):
+    """ 一次读出 basic set/map 的 (等式, 不等式) 系数矩阵, 与 equalities_matrix/inequalities_matrix 的结果相同.
+
+    约束系统以 polylib 格式打印为一段文本, 一次 binding 调用得到全部系数;
+    文本中的整数按任意精度解析, 只有超出 int64 时才返回 dtype=object 的数组.
+    isl 只能以 polylib 格式打印 basic set, basic map 先 wrap 为 [IN, OUT] 上的 basic set,
+    wrap 不会化简或重排约束. polylib 每行的列依次为 eq/ineq 标记, SET (IN, OUT), DIV, PARAM, CST.
+
+    :param types: 列顺序, 默认为 CST, PARAM, SET, DIV 或 CST, PARAM, IN, OUT, DIV.
+    """
+    is_map = isinstance(data, isl.basic_map)
+    if types is None:
+        types = _BMAP_TYPES if is_map else _BSET_TYPES
+    n_in = data.dim(isl.ISL_DIM_TYPE.IN) if is_map else 0
+    n_out = data.dim(isl.ISL_DIM_TYPE.OUT if is_map else isl.ISL_DIM_TYPE.SET)
+    n_div = data.dim(isl.ISL_DIM_TYPE.DIV)
+    bset = data
+    if is_map:
+        lst = isl.map(data).wrap().basic_set_list()
+        if lst.size() == 0:
+            # 空的 basic map 在转换为 map 时被丢弃, 只能逐元素读取.
+            result = (isl_mat_to_numpy(data.equalities_matrix(*types)),
+                      isl_mat_to_numpy(data.inequalities_matrix(*types)))
+            return tuple(_to_sparse(m) for m in result) if sparse else result
+        bset = lst.at(0)
+    printer = isl.printer.to_str()
+    printer = printer.set_output_format(isl.ISL_FORMAT.POLYLIB)
+    printer = printer.print_basic_set(bset)
+    tokens = [int(t) for t in printer.get_str().split()]
+    n_rows, width = tokens[0], tokens[1]
+    # 每种维度在 polylib 行中的列, 下标 0 是 eq/ineq 标记.
+    n_set = n_in + n_out
+    columns = {isl.ISL_DIM_TYPE.CST: [width - 1],
+               isl.ISL_DIM_TYPE.IN: list(range(1, 1 + n_in)),
+               isl.ISL_DIM_TYPE.OUT: list(range(1 + n_in, 1 + n_set)),
+               isl.ISL_DIM_TYPE.SET: list(range(1, 1 + n_set)),
+               isl.ISL_DIM_TYPE.DIV: list(range(1 + n_set, 1 + n_set + n_div)),
+               isl.ISL_DIM_TYPE.PARAM: list(range(1 + n_set + n_div, width - 1))}
+    order = [c for t in types for c in columns[t]]
+    eqs, ineqs = [], []
+    for k in range(n_rows):
+        row = tokens[2 + k * width:2 + (k + 1) * width]
+        (ineqs if row[0] else eqs).append([row[c] for c in order])
+    result = (_rows_to_numpy(eqs, len(order)), _rows_to_numpy(ineqs, len(order)))
+    return tuple(_to_sparse(m) for m in result) if sparse else result
+
+
+def numpy_to_isl_mat(array) -> isl.mat:
+    """ isl_mat_to_numpy 的逆操作. """
+    array = np.asarray(array)
+    rows, cols = array.shape
+    mat = isl.mat.alloc(rows, cols)
+    # set_element_si 的参数是 C 的 int, 超出 int32 的值会被 ctypes 静默截断, 改用 isl.val 传入.
+    lo, hi = np.iinfo(np.int32).min, np.iinfo(np.int32).max
+    for i, row in enumerate(array.tolist()):
+        for j, v in enumerate(row):
+            if lo <= v <= hi:
+                mat = mat.set_element_si(i, j, int(v))
+            else:
+                mat = mat.set_element_val(i, j, isl.val(str(v)))
+    return mat
+
+
+_BSET_TYPES = (isl.ISL_DIM_TYPE.CST, isl.ISL_DIM_TYPE.PARAM,
+               isl.ISL_DIM_TYPE.SET, isl.ISL_DIM_TYPE.DIV)
+_BMAP_TYPES = (isl.ISL_DIM_TYPE.CST, isl.ISL_DIM_TYPE.PARAM,
+               isl.ISL_DIM_TYPE.IN, isl.ISL_DIM_TYPE.OUT, isl.ISL_DIM_TYPE.DIV)
+
+
+def _as_space(space: Union[isl.space, str], cls) -> isl.space:
+    """ space 可以直接给出, 也可以是 "[N] -> { [i, j] -> [k] }" 这样的描述. """
+    if isinstance(space, str):
+        return cls(space).get_space()
+    return space
+
+
+def _constraint_matrix(array, n_cols: int):
+    array = np.asarray(array)
+    if array.size == 0:
+        array = array.reshape(0, n_cols)
+    assert array.ndim == 2 and array.shape[1] == n_cols, \
+        f"expected a (n, {n_cols}) constraint matrix, got shape {array.shape}"
+    return numpy_to_isl_mat(array)
+
+
+def _n_constraint_cols(space: isl.space, types) -> int:
+    # CST 一列, DIV 列数由矩阵决定, 这里只统计 space 中的维度.
+    return 1 + sum(space.dim(t) for t in types[1:-1])
+
+
+def basic_set_from_numpy(space: Union[isl.space, str], eqs, ineqs, n_div: int = 0) -> isl.basic_set:
+    """ 由等式和不等式矩阵一次构造 basic set, 列顺序与 display_constraints 相同: CST, PARAM, SET, DIV. """
+    space = _as_space(space, isl.basic_set)
+    n_cols = _n_constraint_cols(space, _BSET_TYPES) + n_div
+    return isl.basic_set.from_constraint_matrices(space, _constraint_matrix(eqs, n_cols),
+                                                  _constraint_matrix(ineqs, n_cols), *_BSET_TYPES)
+
+
+def basic_map_from_numpy(space: Union[isl.space, str], eqs, ineqs, n_div: int = 0) -> isl.basic_map:
+    """ 由等式和不等式矩阵一次构造 basic map, 列顺序与 display_constraints 相同: CST, PARAM, IN, OUT, DIV. """
+    space = _as_space(space, isl.basic_map)
+    n_cols = _n_constraint_cols(space, _BMAP_TYPES) + n_div
+    return isl.basic_map.from_constraint_matrices(space, _constraint_matrix(eqs, n_cols),
+                                                  _constraint_matrix(ineqs, n_cols), *_BMAP_TYPES)
+
+
+def basic_sets_from_numpy(space: Union[isl.space, str], eqs, ineqs, n_div: int = 0) -> List[isl.basic_set]:
+    """ 批量构造, eqs/ineqs 为 (k, rows, cols) 的三维数组, 第一维为关系个数. """
+    space = _as_space(space, isl.basic_set)
+    return [basic_set_from_numpy(space, e, i, n_div) for e, i in zip(eqs, ineqs)]
+
+
+def basic_maps_from_numpy(space: Union[isl.space, str], eqs, ineqs, n_div: int = 0) -> List[isl.basic_map]:
+    """ 批量构造, eqs/ineqs 为 (k, rows, cols) 的三维数组, 第一维为关系个数. """
+    space = _as_space(space, isl.basic_map)
+    return [basic_map_from_numpy(space, e, i, n_div) for e, i in zip(eqs, ineqs)]
+
+
+def display_constraints(data: Union[isl.basic_map, isl.basic_set, isl.map, isl.set,
+                                    isl.union_map, isl.union_set], limit: Optional[int] = None):
+    """ basic set/map 返回 (不等式, 等式) 两个表; 其他类型返回整个关系的长表, 见 constraints_table. """
+    if not isinstance(data, (isl.basic_map, isl.basic_set)):
+        return constraints_table(data, limit)
+    titles = bmap_dim_titles(data) if isinstance(data, isl.basic_map) else bset_dim_titles(data)
+    eqs, ineqs = constraint_matrices_to_numpy(data)
+    df_eq = pandas.DataFrame(eqs, columns=titles, index=[
+                             '' for i in eqs]) if len(eqs) else None
+    df_ineq = pandas.DataFrame(ineqs, columns=titles, index=[
+                               '' for i in ineqs]) if len(ineqs) else None
+    return (df_ineq, df_eq)
 
 
 def bset_dim_titles(m: isl.basic_set):
@@ -159,16 +819,107 @@ def bmap_dim_titles(m: isl.basic_map):
     return names
 
 
-def schedule_to_code(domain: isl.union_map, schedule: isl.map):
-    tree = isl.schedule.from_domain(domain)
-    tree = tree.insert_partial_schedule(schedule.as_multi_union_pw_aff())
+# (space 文本, div 个数) -> 列名, 同一个 space 的 disjunct 只计算一次.
+_dim_titles_cache: Dict[Tuple[str, int], List[str]] = {}
+
+
+def _iter_disjuncts(data) -> Iterator[Tuple[str, int, Union[isl.basic_set, isl.basic_map]]]:
+    """ 惰性遍历 (space 文本, disjunct 序号, basic set/map). """
+    if isinstance(data, (isl.basic_set, isl.basic_map)):
+        yield (str(data.get_space()), 0, data)
+    elif isinstance(data, (isl.set, isl.map)):
+        space = str(data.get_space())
+        lst = data.basic_set_list() if isinstance(data, isl.set) else data.basic_map_list()
+        for i in range(lst.size()):
+            yield (space, i, lst.at(i))
+    elif isinstance(data, (isl.union_set, isl.union_map)):
+        lst = data.set_list() if isinstance(data, isl.union_set) else data.map_list()
+        for i in range(lst.size()):
+            yield from _iter_disjuncts(lst.at(i))
+    else:
+        raise TypeError(f"unsupported type {type(data)}")
+
+
+def _cached_dim_titles(space: str, data: Union[isl.basic_set, isl.basic_map]) -> List[str]:
+    key = (space, data.dim(isl.ISL_DIM_TYPE.DIV))
+    titles = _dim_titles_cache.get(key)
+    if titles is None:
+        titles = bmap_dim_titles(data) if isinstance(data, isl.basic_map) else bset_dim_titles(data)
+        _dim_titles_cache[key] = titles
+    return titles
+
+
+def iter_constraint_rows(data) -> Iterator[Dict[str, object]]:
+    """ 惰性生成约束记录, 每个约束一行, 带有 space, disjunct 和 kind(eq/ineq) 标记. """
+    for space, disjunct, bdata in _iter_disjuncts(data):
+        titles = _cached_dim_titles(space, bdata)
+        eqs, ineqs = constraint_matrices_to_numpy(bdata)
+        for kind, mat in (('eq', eqs), ('ineq', ineqs)):
+            for row in mat.tolist():
+                record = {'space': space, 'disjunct': disjunct, 'kind': kind}
+                record.update(zip(titles, row))
+                yield record
+
+
+def constraints_table(data, limit: Optional[int] = None) -> pandas.DataFrame:
+    """ 将 set/map/union_set/union_map 的全部约束放入一张长表.
+
+    :param limit: 只读取前 limit 个约束, 查看很大的依赖关系时不必展开全部 disjunct.
+    """
+    rows = iter_constraint_rows(data)
+    if limit is not None:
+        rows = itertools.islice(rows, limit)
+    df = pandas.DataFrame.from_records(list(rows))
+    if len(df):
+        coeffs = [c for c in df.columns if c not in ('space', 'disjunct', 'kind')]
+        # 不同 space 的列不相同, 缺失的系数显示为 <NA> 而不是浮点数.
+        df[coeffs] = df[coeffs].astype('Int64')
+    return df
+
+
+def print_ast(tree: isl.ast_node, options: isl.ast_print_options,
+              sink: Optional[TextIO] = None) -> Optional[CSource]:
+    """ 将 ast 打印到内存中.
 
-    printer = isl.printer.from_file('/tmp/1.c')
-    printer.set_output_format(isl.ISL_FORMAT.C)
-    builder = isl.ast_build()
-    ast: isl.ast_node = builder.node_from(tree)
-    options = isl.ast_print_options.alloc()
-    ast.print(printer, options)
-    printer.flush()
+    没有 sink 时返回 CSource; 否则顶层 block 的每个子节点单独打印,
+    打印完立即写入 sink, 避免在内存中保留整个 kernel.
+    """
+    if sink is None:
+        printer = isl.printer.to_str()
+        printer.set_output_format(isl.ISL_FORMAT.C)
+        tree.print(printer, options)
+        return CSource.from_str(printer.get_str())
+
+    nodes = [tree]
+    if isinstance(tree, isl.ast_node_block):
+        children: isl.ast_node_list = tree.children()
+        nodes = [children.at(i) for i in range(children.size())]
+    for node in nodes:
+        printer = isl.printer.to_str()
+        printer.set_output_format(isl.ISL_FORMAT.C)
+        node.print(printer, options)
+        sink.write(printer.get_str())
+    sink.flush()
+    return None
 
-    return CSource('/tmp/1.c')
+
+def schedule_to_code(domain: isl.union_map, schedule: isl.map,
+                     sink: Optional[TextIO] = None,
+                     tile_sizes: Optional[TileSizes] = None) -> Optional[CSource]:
+    """
+    :param tile_sizes: 对 schedule 对应的 band 做 tiling. 这里没有依赖信息,
+                       由调用者保证该 schedule 的各维是可以交换的.
+    """
+    with isl_lock:
+        tree = isl.schedule.from_domain(domain)
+        tree = tree.insert_partial_schedule(schedule.as_multi_union_pw_aff())
+        if tile_sizes is not None:
+            band: isl.schedule_node_band = tree.get_root().child(0)
+            sizes = _band_tile_sizes(band, tile_sizes)
+            if sizes is not None:
+                tree = tile_band(band, sizes).schedule()
+
+        builder = isl.ast_build()
+        ast: isl.ast_node = builder.node_from(tree)
+        options = isl.ast_print_options.alloc()
+        return print_ast(ast, options, sink)
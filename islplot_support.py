@@ -20,10 +20,11 @@ def _vertex_to_rational_point(vertex):
 
     value = []
 
-    for i in range(expr.dim(dim_type.out)):
+    for i in range(expr.dim(_islpy.dim_type.out)):
         subexpr = expr.get_aff(i)
         val = subexpr.get_constant_val()
-        value.append((val.get_num_si(), val.get_den_val().to_python()))
+        den = val.get_den_val()
+        value.append(((val * den).to_python(), den.to_python()))
 
     return value
 
@@ -46,37 +47,37 @@ def _vertex_get_coordinates(vertex, scale=1):
     r = _vertex_to_rational_point(vertex)
     return [(1.0 * x[0] / x[1])/scale for x in r]
 
-def _is_vertex_on_constraint(vertex, constraint):
+def _vertex_matrix(vertices):
     """
-    Given a vertex and a constraint, check if the vertex is on the plane defined
-    by the constraint. For inequality constraints, the plane we look at is the
-    extremal plane that separates the elements that fulfill an inequality
-    constraint from the elements that do not fulfill this constraints.
+    Return the vertices as an integer matrix of homogeneous coordinates. Row i
+    is (d, n_0, ..., n_k) such that n_j / d is coordinate j of vertex i.
     """
-    r = _vertex_to_rational_point(vertex)
-
-    dims = constraint.space.dim(dim_type.set)
-    v = []
-    for d in range(dims):
-        v.append(constraint.get_coefficient_val(dim_type.set, d).get_num_si())
-
-    summ = 0
-
     import numpy
-    for i in range(dims):
-        prod = 1
-        for j in range(dims):
-            if i == j:
-                prod *= r[j][0]
-            else:
-                prod *= r[j][1]
-        summ += v[i] * prod
-
-    constant = constraint.get_constant_val().get_num_si()
-    summ += numpy.product([x[1] for x in r]) * constant
-
-    return int(summ) == 0
-
+    from math import gcd
+    rational = [_vertex_to_rational_point(v) for v in vertices]
+    n = len(rational[0]) if rational else 0
+    rows = []
+    for r in rational:
+        den = 1
+        for _, d in r:
+            den = den * d // gcd(den, d)
+        rows.append([den] + [num * (den // d) for num, d in r])
+    # The numerators are exact Python integers, keep them exact if they do not
+    # fit into int64.
+    return numpy.array(rows, dtype=object).reshape(len(rows), 1 + n)
+
+def _face_constraint_matrix(bset):
+    """
+    Return the constant and set coefficients of all constraints of a basic
+    set, one row per constraint, equalities first.
+    """
+    import numpy
+    types = (_islpy.dim_type.cst, _islpy.dim_type.set,
+             _islpy.dim_type.param, _islpy.dim_type.div)
+    n = bset.dim(_islpy.dim_type.set)
+    return numpy.vstack([_mat_to_numpy(mat)[:, :1 + n]
+                         for mat in (bset.equalities_matrix(*types),
+                                     bset.inequalities_matrix(*types))])
 
 def bset_get_vertex_coordinates(bset_data, scale=1):
     """
@@ -152,6 +153,20 @@ def angle(Q,M,O,N):
     else:
         return -formular(OQ,OM)
 
+def _order_face(points):
+    """
+    Given the lexicographically ordered, distinct vertices of a face, return
+    the order of their positions such that connecting subsequent vertices
+    yields a convex shape.
+    """
+    if len(points) <= 2:
+        return list(range(len(points)))
+    A, B, C = points[:3]
+    N = norm(A,B,C)
+    center = [(A[0] + B[0]) / 2, (A[1] + B[1]) / 2, (A[2] + B[2]) / 2]
+    f = lambda k: angle(A, points[k], center, N)
+    return sorted(range(len(points)), key=f)
+
 def get_vertices_for_constraint(vertices, constraint):
     """
     Return the list of vertices within a hyperspace.
@@ -161,10 +176,14 @@ def get_vertices_for_constraint(vertices, constraint):
     are returned. We then sort the vertices such that the order defines a
     convex shape.
     """
-    points = []
-    for v in vertices:
-        if _is_vertex_on_constraint(v, constraint):
-            points.append(_vertex_get_coordinates(v))
+    import numpy
+    dims = constraint.space.dim(_islpy.dim_type.set)
+    row = numpy.array([constraint.get_constant_val().to_python()] +
+                      [constraint.get_coefficient_val(_islpy.dim_type.set, d).to_python()
+                       for d in range(dims)], dtype=numpy.int64)
+    homogeneous = _vertex_matrix(vertices)
+    on_plane = homogeneous @ row == 0 if len(vertices) else numpy.zeros(0, dtype=bool)
+    points = (homogeneous[on_plane, 1:] / homogeneous[on_plane, :1]).tolist()
 
     if len(points) == 0:
         return None
@@ -172,34 +191,62 @@ def get_vertices_for_constraint(vertices, constraint):
     points.sort()
     import itertools
     points = list(points for points,_ in itertools.groupby(points))
+    return [points[k] for k in _order_face(points)]
 
-    A = points[0]
-    if len(points) == 1:
-        return [A]
-    B = points[1]
-    if len(points) == 2:
-        return [A, B]
-    C = points[2]
-    N = norm(A,B,C)
-    center = [(A[0] + B[0]) / 2, (A[1] + B[1]) / 2, (A[2] + B[2]) / 2]
-    f = lambda a: angle(A, a, center, N)
-    points = sorted(points, key=f)
-    return points
-
-def isSubset(parent, child):
-    if len(parent) <= len(child):
-        return False
-    for c in child:
-        contained = False
-        for p in parent:
-            if p == c:
-                contained = True
-                break
-
-        if not contained:
-            return False
+def _bset_faces(basicSet):
+    """
+    Return the distinct vertex coordinates of a basic set and its faces as
+    lists of vertex indices, ordered as bset_get_faces returns them.
+
+    The vertices and the constraints are extracted once as integer matrices,
+    vertex i lies on constraint k iff the exact product of row k of the
+    constraints with the homogeneous coordinates of vertex i is zero. A face is
+    the set of vertices on one constraint; duplicate faces and faces that are
+    contained in a larger one are dropped.
+    """
+    import numpy
+    vertices = []
+    basicSet.compute_vertices().foreach_vertex(vertices.append)
+    if len(vertices) == 0:
+        return [], []
+    homogeneous = _vertex_matrix(vertices)
+    constraints = _face_constraint_matrix(basicSet)
+    # Every entry of the product is a sum of 1 + n terms; compute it in int64
+    # only if no sum can overflow, otherwise with exact Python integers.
+    bound = int(numpy.abs(homogeneous).max()) * int(numpy.abs(constraints).max(initial=0)) \
+        * homogeneous.shape[1]
+    if bound < 2 ** 63:
+        homogeneous = homogeneous.astype(numpy.int64)
+        constraints = constraints.astype(numpy.int64)
+    else:
+        constraints = constraints.astype(object)
+    homogeneous = numpy.array(sorted(set(map(tuple, homogeneous.tolist()))),
+                              dtype=homogeneous.dtype)
+    coordinates = [[num / row[0] for num in row[1:]] for row in homogeneous.tolist()]
+
+    incidence = constraints @ homogeneous.T == 0
+    unique = {}
+    for mask in incidence:
+        if mask.any():
+            unique.setdefault(mask.tobytes(), mask)
+    if len(unique) == 0:
+        return coordinates, []
+    masks = numpy.array(list(unique.values()))
+    counts = masks.astype(numpy.int64)
+    sizes = counts.sum(axis=1)
+    # Face i is a proper subset of face j iff all of its vertices are on j
+    # and j has more of them.
+    common = counts @ counts.T
+    subset = (common == sizes[:, None]) & (sizes[None, :] > sizes[:, None])
+    masks = masks[~subset.any(axis=1)]
 
-    return True
+    faces = []
+    for mask in masks:
+        indices = sorted(numpy.nonzero(mask)[0].tolist(), key=lambda i: coordinates[i])
+        order = _order_face([coordinates[i] for i in indices])
+        faces.append([indices[k] for k in order])
+    faces.sort(key=lambda face: [coordinates[i] for i in face])
+    return coordinates, faces
 
 def bset_get_faces(basicSet):
     """
@@ -211,21 +258,8 @@ def bset_get_faces(basicSet):
     Vertices may have rational coordinates. A vertice is represented as a three
     tuple.
     """
-    faces = []
-    vertices = []
-    basicSet.compute_vertices().foreach_vertex(vertices.append)
-    f = lambda c: faces.append(get_vertices_for_constraint(vertices, c))
-    basicSet.foreach_constraint(f)
-
-    # Remove empty elements, duplicates and subset of elements
-    faces = filter(lambda x: not x == None, faces)
-    faces = list(faces)
-    faces = [x for x in faces if not
-                any(isSubset(y, x) for y in faces if x is not y)]
-    faces.sort()
-    import itertools
-    faces = list(faces for faces,_ in itertools.groupby(faces))
-    return faces
+    coordinates, faces = _bset_faces(basicSet)
+    return [[coordinates[i] for i in face] for face in faces]
 
 def set_get_faces(set_data):
     """
@@ -244,31 +278,6 @@ def set_get_faces(set_data):
     return list(map(bset_get_faces, bsets))
 
 
-def make_tuple(vertex):
-    return (vertex[0], vertex[1], vertex[2])
-
-def get_vertex_to_index_map(vertexlist):
-    res = {}
-    i = 0
-    for v in vertexlist:
-        res[make_tuple(v)] = i
-        i += 1
-    return res
-
-def translate_faces_to_indexes(faces, vertexmap):
-    """
-    Given a list of faces, translate the vertex defining it from their explit
-    offsets to their index as provided by the vertexmap, a mapping from vertices
-    to vertex indices.
-    """
-    new_faces = []
-    for face in faces:
-        new_face = []
-        for vertex in face:
-            new_face.append(vertexmap[make_tuple(vertex)])
-        new_faces.append(new_face)
-    return new_faces
-
 def get_vertices_and_faces(set_data):
     """
     Given an isl set, return a tuple that contains the vertices and faces of
@@ -277,32 +286,30 @@ def get_vertices_and_faces(set_data):
     vertices of a face are sorted such that connecting subsequent vertices
     yields a convex form.
     """
-    data = set_get_faces(set_data)
-    if len(data) == 0:
+    bsets = []
+    set_data.foreach_basic_set(bsets.append)
+    if len(bsets) == 0:
         return ([], [])
 
-    faces = data[0]
-    vertices = [vertex for face in faces for vertex in face]
-    vertices.sort()
-    import itertools
-    vertices = list(vertices for vertices, _ in itertools.groupby(vertices))
-    vertexmap = get_vertex_to_index_map(vertices)
-
-    faces = translate_faces_to_indexes(faces, vertexmap)
+    coordinates, faces = _bset_faces(bsets[0])
+    used = sorted({i for face in faces for i in face}, key=lambda i: coordinates[i])
+    index = {i: position for position, i in enumerate(used)}
+    vertices = [coordinates[i] for i in used]
+    faces = [[index[i] for i in face] for face in faces]
     return (vertices, faces)
 
 def _constraint_make_equality_set(x):
-    e = Constraint.equality_alloc(x.get_local_space())
+    e = _islpy.Constraint.equality_alloc(x.get_local_space())
     e = e.set_constant_val(x.get_constant_val().get_num_si())
 
-    for i in range(x.space.dim(dim_type.set)):
-        e = e.set_coefficient_val(dim_type.set, i,
-                x.get_coefficient_val(dim_type.set, i).get_num_si())
-    for i in range(x.space.dim(dim_type.param)):
-        e = e.set_coefficient_val(dim_type.param, i,
-                x.get_coefficient_val(dim_type.param, i).get_num_si())
+    for i in range(x.space.dim(_islpy.dim_type.set)):
+        e = e.set_coefficient_val(_islpy.dim_type.set, i,
+                x.get_coefficient_val(_islpy.dim_type.set, i).get_num_si())
+    for i in range(x.space.dim(_islpy.dim_type.param)):
+        e = e.set_coefficient_val(_islpy.dim_type.param, i,
+                x.get_coefficient_val(_islpy.dim_type.param, i).get_num_si())
 
-    return BasicSet.universe(x.space).add_constraint(e)
+    return _islpy.BasicSet.universe(x.space).add_constraint(e)
 
 def bset_get_points(bset_data, only_hull=False, scale=1):
     """
@@ -315,7 +322,7 @@ def bset_get_points(bset_data, only_hull=False, scale=1):
 
     if only_hull:
           hull = [None]
-          hull[0] = Set.empty(bset_data.space)
+          hull[0] = _islpy.Set.empty(bset_data.space)
           def add(c):
             const_eq = _constraint_make_equality_set(c)
             const_eq = const_eq.intersect(bset_data)
@@ -323,79 +330,125 @@ def bset_get_points(bset_data, only_hull=False, scale=1):
           bset_data.foreach_constraint(add)
           bset_data = hull[0]
 
-    points = []
-    f = lambda x: points.append(get_point_coordinates(x, scale))
-    bset_data.foreach_point(f)
-    points = sorted(points)
-    return points
+    return (set_get_point_array(bset_data) / scale).tolist()
+
+def _mat_to_numpy(mat):
+    """
+    Return an isl matrix as an int64 array, or as an object array of exact
+    integers if an element does not fit into int64.
+    """
+    import numpy
+    rows = [[mat.get_element_val(i, j).to_python() for j in range(mat.cols())]
+            for i in range(mat.rows())]
+    try:
+        out = numpy.array(rows, dtype=numpy.int64)
+    except OverflowError:
+        out = numpy.array(rows, dtype=object)
+    return out.reshape(mat.rows(), mat.cols())
+
+def set_get_point_array(set_):
+    """
+    Given a (basic|union|) set, return its integer points as an int64 numpy
+    array of shape (n_points, n_dims) in lexicographic order. The bounds and
+    constraint matrices of each basic set are extracted once and the points
+    are enumerated with numpy instead of one callback per point.
+
+    :param set_: a (basic|union|)set, its parameters must be fixed.
+    """
+    import numpy
+    from petplot.points import scan_points, merge_points
+    if isinstance(set_, _islpy.UnionSet):
+        arrays = []
+        set_.foreach_set(lambda s: arrays.append(set_get_point_array(s)))
+        if len(arrays) == 0:
+            return numpy.zeros((0, 0), dtype=numpy.int64)
+        points = numpy.vstack(arrays)
+        return points[numpy.lexsort(points.T[::-1])]
+    if isinstance(set_, _islpy.BasicSet):
+        set_ = _islpy.Set.from_basic_set(set_)
+    n_param = set_.dim(_islpy.dim_type.param)
+    values = numpy.zeros(n_param, dtype=numpy.int64)
+    if n_param:
+        params = set_.params()
+        if not params.is_singleton():
+            raise ValueError("the parameters must be fixed, use intersect_params first")
+        point = params.sample_point()
+        values[:] = [point.get_coordinate_val(_islpy.dim_type.param, i).to_python()
+                     for i in range(n_param)]
+    types = (_islpy.dim_type.cst, _islpy.dim_type.param,
+             _islpy.dim_type.set, _islpy.dim_type.div)
+    arrays = []
+    for bset in set_.get_basic_sets():
+        if bset.is_empty():
+            continue
+        bounded = _islpy.Set.from_basic_set(bset)
+        lo = [bounded.dim_min_val(i).to_python() for i in range(bset.dim(_islpy.dim_type.set))]
+        hi = [bounded.dim_max_val(i).to_python() for i in range(bset.dim(_islpy.dim_type.set))]
+        matrices = []
+        for mat in (bset.equalities_matrix(*types), bset.inequalities_matrix(*types)):
+            m = _mat_to_numpy(mat)
+            m[:, 0] += m[:, 1:1 + n_param] @ values
+            matrices.append(numpy.delete(m, numpy.s_[1:1 + n_param], axis=1))
+        arrays.append(scan_points(matrices[0], matrices[1], lo, hi))
+    return merge_points(arrays, set_.dim(_islpy.dim_type.set))
+
+def get_bounding_box(set_data, offset=0):
+    """
+    Return the inclusive lower and upper corner of the bounding box of a set,
+    extended by offset in every dimension, as two lists.
+
+    :param set_data: The set, its parameters must be fixed.
+    :param offset: The padding added on both sides of every dimension.
+    """
+    n = set_data.dim(_islpy.dim_type.set)
+    lo = [set_data.dim_min_val(i).to_python() - offset for i in range(n)]
+    hi = [set_data.dim_max_val(i).to_python() + offset for i in range(n)]
+    return lo, hi
 
 def get_rectangular_hull(set_data, offset=0):
-    uset_data = Set.universe(set_data.get_space())
-
-    for dim in range(0,2):
-        ls = LocalSpace.from_space(set_data.get_space())
-        c = Constraint.inequality_alloc(ls)
-        incr = Map("{{[i]->[i+{0}]}}".format(offset))
-        decr = Map("{{[i]->[i-{0}]}}".format(offset))
-
-        dim_val = Aff.zero_on_domain(ls).set_coefficient_val(dim_type.in_, dim,
-                                                             1)
-        dim_val = PwAff.from_aff(dim_val)
-        dim_val = Map.from_pw_aff(dim_val)
-
-        space = dim_val.get_space()
-        dim_cst = Map.universe(space)
-        max_set = Set.from_pw_aff(set_data.dim_max(dim))
-        dim_cst = dim_cst.intersect_range(max_set)
-        dim_cst = dim_cst.apply_range(incr)
-
-        diff = Map.lex_le_map(dim_val, dim_cst)
-        uset_data = uset_data.intersect(diff.domain())
-
-        dim_cst = Map.universe(space)
-        min_set = Set.from_pw_aff(set_data.dim_min(dim))
-        dim_cst = dim_cst.intersect_range(min_set)
-        dim_cst = dim_cst.apply_range(decr)
-
-        diff = Map.lex_ge_map(dim_val, dim_cst)
-        uset_data = uset_data.intersect(diff.domain())
-
-    return uset_data
-
-def cmp_points(a, b):
-    a = Set.from_point(a)
-    b = Set.from_point(b)
-    if a.lex_le_set(b).is_empty():
-        return 1
-    else:
-        return -1
-
-def cmp_to_key(mycmp):
-    'Convert a cmp= function into a key= function'
-    class Key(object):
-        def __init__(self, obj, *args):
-            self.obj = obj
-        def __lt__(self, other):
-            return mycmp(self.obj, other.obj) < 0
-        def __gt__(self, other):
-            return mycmp(self.obj, other.obj) > 0
-        def __eq__(self, other):
-            return mycmp(self.obj, other.obj) == 0
-        def __le__(self, other):
-            return mycmp(self.obj, other.obj) <= 0
-        def __ge__(self, other):
-            return mycmp(self.obj, other.obj) >= 0
-        def __ne__(self, other):
-            return mycmp(self.obj, other.obj) != 0
-    return Key
-
-def sort_points(points):
+    """
+    Return the bounding box of a set, extended by offset in every dimension,
+    as an isl set. The bounds are the symbolic dim_min/dim_max of every
+    dimension, so the hull of a parametric set is parametric as well.
+    """
+    space = set_data.get_space()
+    hull = _islpy.Set.universe(space)
+    ls = _islpy.LocalSpace.from_space(space)
+
+    for dim in range(set_data.dim(_islpy.dim_type.set)):
+        dim_val = _islpy.PwAff.from_aff(_islpy.Aff.var_on_domain(ls, _islpy.dim_type.set, dim))
+        lo = set_data.dim_min(dim).insert_domain(space).add_constant_val(-offset)
+        hi = set_data.dim_max(dim).insert_domain(space).add_constant_val(offset)
+        hull = hull.intersect(dim_val.ge_set(lo)).intersect(dim_val.le_set(hi))
+
+    return hull
+
+def _point_key(point):
+    if isinstance(point, _islpy.Point):
+        return tuple(point.get_coordinate_val(_islpy.dim_type.set, i).to_python()
+                     for i in range(point.get_space().dim(_islpy.dim_type.set)))
+    return tuple(point)
+
+def sort_points(points, threshold=1024):
     """
     Given a list of points, sort them lexicographically.
 
-    :param points: The list of points that will be sorted.
+    The coordinates are extracted once and compared as integer tuples, large
+    lists are sorted with numpy.lexsort.
+
+    :param points: The list of points that will be sorted, either isl points
+                   or coordinate lists.
+    :param threshold: Lists with at least this many points are sorted with
+                      numpy.
     """
-    return sorted(points, key=cmp_to_key(cmp_points))
+    points = list(points)
+    keys = [_point_key(p) for p in points]
+    if len(points) < threshold or len(set(len(k) for k in keys)) > 1:
+        order = sorted(range(len(points)), key=keys.__getitem__)
+    else:
+        import numpy
+        order = numpy.lexsort(numpy.array(keys).T[::-1])
+    return [points[i] for i in order]
 
 # Variables to give each set a different id
 # ID is used to give each set a different size    
@@ -406,9 +459,7 @@ def set_get_points(set_):
     Given a set, returns the points in a list
     :param set_: a (basic|union|)set 
     """
-    points = []
-    set_.foreach_basic_set(lambda bs: points.extend(bset_get_points(bs)))
-    return points
+    return set_get_point_array(set_).tolist()
 
 def _set_get_points_tagged(set_):
     """
@@ -472,15 +523,8 @@ def _map_get_points_tagged(map_):
     global count
     global dict2
     ids = {}
-    full_points = []
-    domain_pts = []
-    map_.domain().foreach_point(domain_pts.append)
-    for dp in domain_pts:
-        range_points = []
-        limited = map_.intersect_domain(_islpy.basic_set(dp))
-        limited.range().foreach_point(range_points.append)
-        for rp in range_points:
-            full_points.append(get_point_coordinates(dp) + get_point_coordinates(rp))
+    # Enumerate the wrapped relation once, each row is a (domain, range) pair.
+    full_points = set_get_point_array(map_.wrap()).astype(float).tolist()
     space_map = map_.get_space()
     name_in = space_map.get_tuple_name(_islpy.dim_type.in_)
     name_out = space_map.get_tuple_name(_islpy.dim_type.out)
@@ -629,4 +673,4 @@ def plot(data):
 
 __all__ = ['bset_get_vertex_coordinates', 'bset_get_faces', 'set_get_faces',
            'get_vertices_and_faces', 'get_point_coordinates', 'bset_get_points',
-           'get_rectangular_hull', 'sort_points', 'set_get_points', 'set_get_points_tagged', '_get_random_string', 'plot_uset_points_html', '_map_get_points_tagged', 'plot_umap_points_html', 'format', 'plot']
+           'get_rectangular_hull', 'get_bounding_box', 'sort_points', 'set_get_points', 'set_get_points_tagged', '_get_random_string', 'plot_uset_points_html', '_map_get_points_tagged', 'plot_umap_points_html', 'format', 'plot']
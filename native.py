@@ -0,0 +1,108 @@
+import os
+import re
+import ctypes
+import shutil
+import tempfile
+import subprocess
+import numpy as np
+from typing import Dict, List, Optional, Sequence
+from common import CSource, kernel_source, restrict_array_params
+from bench import DEFAULT_FLAGS, KERNEL_PRELUDE, KernelParam, parse_signature
+
+
+def _eval_size(param: KernelParam, values: Dict[str, int]) -> Optional[int]:
+    """ 用标量参数的值计算数组元素个数, 表达式中含有除法等无法安全求值的内容时返回 None. """
+    size = 1
+    for dim in param.dims:
+        if not re.fullmatch(r'[\w\s+\-*()]+', dim):
+            return None
+        try:
+            size *= int(eval(dim, {'__builtins__': {}}, dict(values)))
+        except Exception:
+            return None
+    return size
+
+
+class NativeKernel:
+    """ 把 kernel 编译成共享库并通过 ctypes 调用, 数组参数直接传入 NumPy 数组的缓冲区, 不做拷贝.
+
+    :param source: 包含 kernel 函数的 C 源码.
+    :param func_name: kernel 函数名.
+    :param code: CodeGenerator 生成的循环代码, 替换第 region 个 scop 区域; 为 None 时编译原始代码.
+    :param restrict: 为数组参数加上 restrict.
+    :param sizes: 见 bench.parse_signature.
+    :param flags: 编译选项, 默认为 bench.DEFAULT_FLAGS; 代码中含有 omp pragma 时自动加上 -fopenmp.
+    :param workdir: 保存源码和共享库的目录, 默认使用临时目录并在加载后删除.
+    """
+
+    def __init__(self, source: str, func_name: str, code: Optional[CSource] = None, region: int = 0,
+                 restrict: bool = True, sizes: Optional[Dict[str, str]] = None,
+                 cc: Optional[str] = None, flags: Optional[Sequence[str]] = None,
+                 workdir: Optional[str] = None) -> None:
+        self.func_name = func_name
+        self.params: List[KernelParam] = parse_signature(source, func_name, sizes)
+        if code is not None:
+            source = kernel_source(source, func_name, code, region=region, restrict=restrict).context
+        elif restrict:
+            source = restrict_array_params(source, func_name)
+        self.source = source
+        tmpdir = workdir or tempfile.mkdtemp(prefix='isl_learn_native_')
+        os.makedirs(tmpdir, exist_ok=True)
+        try:
+            self._lib = ctypes.CDLL(self._compile(tmpdir, cc, flags))
+        finally:
+            if workdir is None:
+                # dlopen 之后删除文件不影响已经加载的共享库.
+                shutil.rmtree(tmpdir, ignore_errors=True)
+        self._func = getattr(self._lib, func_name)
+        self._func.argtypes = [ctypes.c_void_p if p.is_array else np.ctypeslib.as_ctypes_type(p.dtype)
+                               for p in self.params]
+        self._func.restype = None
+
+    def _compile(self, workdir: str, cc: Optional[str], flags: Optional[Sequence[str]]) -> str:
+        cc = cc or os.environ.get('CC', 'cc')
+        flags = list(DEFAULT_FLAGS if flags is None else flags)
+        if '#pragma omp' in self.source and not any(f.startswith('-fopenmp') for f in flags):
+            flags.append('-fopenmp')
+        kernel_path = os.path.join(workdir, self.func_name + '_kernel.c')
+        # 同一路径的共享库只会被 dlopen 一次, 因此每个实例使用不同的文件名.
+        fd, lib_path = tempfile.mkstemp(dir=workdir, prefix=f"lib{self.func_name}_", suffix='.so')
+        os.close(fd)
+        with open(kernel_path, 'w') as f:
+            f.write(KERNEL_PRELUDE + self.source + '\n#undef main\n')
+        cmd = [cc, '-std=gnu11', '-shared', '-fPIC', *flags, '-o', lib_path, kernel_path, '-lm']
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(f"failed to compile {self.func_name}: {' '.join(cmd)}\n{proc.stderr}")
+        return lib_path
+
+    def __call__(self, *args, **kwargs) -> None:
+        """ 按位置或参数名传入 kernel 的参数, 数组参数必须是 dtype 匹配, C 连续且可写的 ndarray. """
+        if len(args) > len(self.params):
+            raise TypeError(f"{self.func_name}() takes {len(self.params)} arguments but {len(args)} were given")
+        bound = dict(zip((p.name for p in self.params), args))
+        for name, value in kwargs.items():
+            if name in bound:
+                raise TypeError(f"{self.func_name}() got multiple values for argument '{name}'")
+            bound[name] = value
+        missing = [p.name for p in self.params if p.name not in bound]
+        if missing:
+            raise TypeError(f"{self.func_name}() missing arguments: {', '.join(missing)}")
+        scalars = {p.name: bound[p.name] for p in self.params if not p.is_array}
+        call_args = []
+        for p in self.params:
+            value = bound[p.name]
+            if not p.is_array:
+                call_args.append(value)
+                continue
+            if not isinstance(value, np.ndarray):
+                raise TypeError(f"argument '{p.name}' must be a numpy.ndarray")
+            if value.dtype != p.dtype:
+                raise TypeError(f"argument '{p.name}' has dtype {value.dtype}, expected {p.dtype} ({p.ctype})")
+            if not value.flags['C_CONTIGUOUS'] or not value.flags['WRITEABLE']:
+                raise ValueError(f"argument '{p.name}' must be C-contiguous and writeable")
+            size = _eval_size(p, scalars)
+            if size is not None and value.size < size:
+                raise ValueError(f"argument '{p.name}' has {value.size} elements, kernel accesses {size}")
+            call_args.append(value.ctypes.data)
+        self._func(*call_args)
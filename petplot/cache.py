@@ -0,0 +1,109 @@
+import sys
+import inspect
+import functools
+import numpy as np
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Tuple
+
+
+def _copy(value: Any) -> Any:
+    """
+    Copy the mutable containers of a cached value, so callers can not change
+    the cached entry. isl objects are immutable and are shared.
+    """
+    if isinstance(value, np.ndarray):
+        return value.copy()
+    if isinstance(value, list):
+        return [_copy(x) for x in value]
+    if isinstance(value, tuple):
+        return tuple(_copy(x) for x in value)
+    return value
+
+
+def _size(value: Any) -> int:
+    """ Estimate the number of bytes held by a cached value. """
+    if isinstance(value, np.ndarray):
+        return sys.getsizeof(value) + (0 if value.base is None else value.nbytes)
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_size(x) for x in value)
+    if isinstance(value, (int, float, bool, str)) or value is None:
+        return sys.getsizeof(value)
+    # An isl object, its text is a fair estimate of its size.
+    return sys.getsizeof(str(value))
+
+
+class GeometryCache:
+    """
+    An in-memory LRU cache for the geometry computed from isl objects, such
+    as vertices, faces and points. Entries are keyed by the function, the
+    canonical text of the isl object and the remaining arguments; the least
+    recently used entries are evicted when the total size exceeds max_bytes.
+
+    :param max_bytes: The maximum estimated size of all cached values.
+    """
+
+    def __init__(self, max_bytes: int = 64 << 20) -> None:
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self._entries: 'OrderedDict[Hashable, Tuple[Any, int]]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return _copy(entry[0])
+        self.misses += 1
+        value = compute()
+        self.put(key, value)
+        return _copy(value)
+
+    def put(self, key: Hashable, value: Any) -> None:
+        size = _size(value)
+        if key in self._entries:
+            self.size -= self._entries.pop(key)[1]
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (value, size)
+        self.size += size
+        self.evict()
+
+    def evict(self) -> None:
+        while self.size > self.max_bytes and self._entries:
+            _, (_, size) = self._entries.popitem(last=False)
+            self.size -= size
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+
+geometry_cache = GeometryCache()
+
+
+def cached(func: Callable) -> Callable:
+    """
+    Memoize a function whose first argument is an isl object in
+    geometry_cache. The other arguments must be hashable.
+    """
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        data, *rest = bound.arguments.values()
+        key = (func.__qualname__, type(data).__name__, str(data), tuple(rest))
+        return geometry_cache.get(key, lambda: func(*args, **kwargs))
+
+    return wrapper
+
+
+__all__ = ['GeometryCache', 'geometry_cache', 'cached']
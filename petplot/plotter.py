@@ -2,17 +2,50 @@ import matplotlib.pyplot as _plt
 from matplotlib import colormaps
 from matplotlib import collections
 from matplotlib.ticker import MaxNLocator
+from matplotlib.quiver import Quiver
 import isl
 from petplot.support import *
+from petplot.points import box_points
 from typing import Tuple, List, Union, Deque
 from dataclasses import dataclass
+import numpy as np
+import warnings
 
 @dataclass
 class ProcessorMap:
     Domain: isl.basic_set
     Range: range
 
-def plot_set_points(set_datas: Union[isl.set, List[isl.set]], color="black", size=10, marker="o", scale=1):
+def _density_edges(set_data, scale, bins):
+    """
+    Return the histogram bin edges along x (dimension 1) and y (dimension 0)
+    that cover all points of a set. Every bin covers the same number of
+    integer coordinates, so a dense set renders without stripes.
+    """
+    lo, hi = set_bounds(set_data)
+    lo = points_coordinates(lo[None, :], scale)[0]
+    hi = points_coordinates(hi[None, :], scale)[0]
+    edges = []
+    for d in (1, 0):
+        extent = int(hi[d] - lo[d] + 1)
+        width = -(-extent // bins)
+        edges.append(lo[d] - .5 + width * np.arange(-(-extent // width) + 1))
+    return edges
+
+
+def _plot_density(hist, edges, color):
+    """
+    Draw a 2-d histogram as an image, empty bins stay transparent.
+    """
+    from matplotlib.colors import LinearSegmentedColormap
+    cmap = LinearSegmentedColormap.from_list("density", ["white", color])
+    image = np.ma.masked_equal(hist.T, 0)
+    _plt.imshow(image, origin="lower", cmap=cmap, interpolation="nearest", aspect="auto",
+                extent=(edges[0][0], edges[0][-1], edges[1][0], edges[1][-1]))
+
+
+def plot_set_points(set_datas: Union[isl.set, List[isl.set]], color="black", size=10, marker="o", scale=1,
+                    density_threshold=100000, bins=512):
     """
     Plot the individual points of a two dimensional isl set.
 
@@ -21,14 +54,40 @@ def plot_set_points(set_datas: Union[isl.set, List[isl.set]], color="black", siz
     :param size: The diameter of the points.
     :param marker: The marker used to mark a point.
     :param scale: Scale the values.
+    :param density_threshold: Sets with more points are rendered as a density
+                              image instead of one marker per point. None
+                              always plots markers.
+    :param bins: The maximal number of density bins along each axis.
     """
     if isinstance(set_datas, (isl.set, isl.basic_set, isl.union_set)):
         set_datas = [set_datas]
     for set_data in set_datas:
-        points = bset_get_points(set_data, scale=scale)
-        dimX = [x[1] for x in points]
-        dimY = [x[0] for x in points]
-        _plt.plot(dimX, dimY, marker, markersize=size, color=color, lw=0)
+        if density_threshold is None:
+            # Every point is drawn anyway, reuse the cached enumeration.
+            points = points_coordinates(set_points(set_data), scale)[:, [1, 0]]
+            _plt.plot(points[:, 0], points[:, 1], marker, markersize=size, color=color, lw=0)
+            continue
+        chunks: List[np.ndarray] = []
+        n_points = 0
+        hist = None
+        for chunk in iter_set_points(set_data):
+            xy = points_coordinates(chunk, scale)[:, [1, 0]]
+            if hist is None:
+                chunks.append(xy)
+                n_points += len(xy)
+                if n_points <= density_threshold:
+                    continue
+                # Too many points for markers, bin them chunk by chunk.
+                edges = _density_edges(set_data, scale, bins)
+                hist = np.zeros((len(edges[0]) - 1, len(edges[1]) - 1))
+                xy = np.vstack(chunks)
+                chunks = []
+            hist += np.histogram2d(xy[:, 0], xy[:, 1], bins=edges)[0]
+        if hist is not None:
+            _plot_density(hist, edges, color)
+            continue
+        points = np.vstack(chunks) if chunks else np.zeros((0, 2))
+        _plt.plot(points[:, 0], points[:, 1], marker, markersize=size, color=color, lw=0)
 
 
 def _plot_arrow(start, end, graph, *args, **kwargs):
@@ -72,9 +131,97 @@ def _plot_arrow(start, end, graph, *args, **kwargs):
                    )
 
 
+def _quiver_head(style, width):
+    """
+    Return the quiver head arguments that draw the arrow style of _plot_arrow,
+    or None if a quiver can not draw the style.
+
+    annotate scales the heads with mutation_scale=15, quiver in multiples of
+    the shaft width.
+    """
+    head = 15 * .4 / width
+    if style == "-|>":
+        return dict(headwidth=head, headlength=head, headaxislength=head)
+    if style == "-":
+        return dict(headwidth=0, headlength=0, headaxislength=0)
+    return None
+
+
+class _ShrunkQuiver(Quiver):
+    """
+    A quiver whose arrows end shrink points before their start and end
+    position, as the shrinkA/shrinkB of annotate do. The gaps are recomputed
+    from the current view on every draw, so they stay constant in points
+    when the axes are rescaled.
+    """
+
+    def __init__(self, ax, starts: np.ndarray, ends: np.ndarray, shrink, **kwargs):
+        self._starts = starts.astype(float)
+        self._delta = ends.astype(float) - self._starts
+        self._shrink = shrink
+        super().__init__(ax, self._starts[:, 0], self._starts[:, 1],
+                         self._delta[:, 0], self._delta[:, 1],
+                         angles='xy', scale_units='xy', scale=1, **kwargs)
+
+    def _shrunk(self) -> Tuple[np.ndarray, np.ndarray]:
+        pixels = self._shrink * self.axes.figure.dpi / 72
+        unit = self.axes.transData.transform([(0, 0), (1, 1)])
+        delta_px = self._delta * np.abs(unit[1] - unit[0])
+        length = np.hypot(delta_px[:, 0], delta_px[:, 1])
+        loop = length == 0
+        factor = np.where(length > 2 * pixels, pixels / np.where(loop, 1, length), 0)
+        origin = self._starts + self._delta * factor[:, None]
+        delta = self._delta * (1 - 2 * factor[:, None])
+        # Self dependences are drawn as a short arrow pointing upwards.
+        delta[loop] = (0, .15)
+        return origin, delta
+
+    def draw(self, renderer):
+        origin, delta = self._shrunk()
+        self.X, self.Y = origin[:, 0], origin[:, 1]
+        self.XY = origin
+        self.set_offsets(origin)
+        self.set_UVC(delta[:, 0], delta[:, 1])
+        super().draw(renderer)
+
+
+def _plot_arrows(starts: np.ndarray, ends: np.ndarray, graph, head, color="black", width=1, shrink=10):
+    """
+    Plot all arrows from starts to ends as a single quiver collection, shafts
+    and arrow heads included.
+
+    :param starts: The (n, 2) array of start positions.
+    :param ends: The (n, 2) array of end positions.
+    :param head: The quiver head arguments, see _quiver_head.
+    :param width: The width of the lines.
+    :param color: The color of the lines.
+    :param shrink: The distance in points around the start/end which is not
+                   plotted to.
+    """
+    ax = graph.gca()
+    ax.update_datalim(np.vstack([starts, ends]))
+    ax.autoscale_view()
+    ax.add_collection(_ShrunkQuiver(ax, starts, ends, shrink, color=color, units='dots',
+                                    width=width * ax.figure.dpi / 72, minlength=0, **head))
+
+
+def _thin_edges(edges: np.ndarray, max_edges: int) -> np.ndarray:
+    """
+    Keep at most max_edges edges by taking every k-th edge. The edges are in
+    lexicographic order, so the sample stays spread over the whole domain.
+    """
+    if max_edges is None or len(edges) <= max_edges:
+        return edges
+    step = -(-len(edges) // max_edges)
+    thinned = edges[::step]
+    warnings.warn("only {0} of {1} edges are drawn, pass max_edges=None to draw all of them"
+                  .format(len(thinned), len(edges)))
+    return thinned
+
+
 def plot_map(map: isl.map, edge_style="-|>", edge_width=1,
              start_color="blue", end_color="orange", line_color="black", marker_size=7,
-             scale=1, shrink=6):
+             scale=1, shrink=6, batch_threshold=200, max_edges=None):
     """
     Given a map from a two dimensional set to another two dimensional set this
     functions prints the relations in this map as arrows going from the input
@@ -87,43 +234,44 @@ def plot_map(map: isl.map, edge_style="-|>", edge_width=1,
     :param shrink: The distance before around the start/end which is not plotted
                    to.
     :param scale: Scale the values.
+    :param batch_threshold: Above this number of edges all arrows are drawn as
+                            one collection instead of one annotation each,
+                            if the collection can draw edge_style ("-|>" or
+                            "-").
+    :param max_edges: Above this number of edges only an evenly spread sample
+                      of max_edges arrows is drawn and a warning is issued.
+                      None draws all edges.
     """
-    all_start: List[Tuple[int, int]] = []
-    all_ends: List[Tuple[int, int]] = []
-    start_points: List[isl.point] = []
-    map_datas: List[isl.basic_map] = []
     labels: List[str] = []
-    map.foreach_basic_map(lambda bmap: map_datas.append(bmap))
-    for map_data in map_datas:
-        if len(labels) == 0:
-            sp = map_data.get_space()
-            for i in range(2):
-                if sp.dim(isl.ISL_DIM_TYPE.OUT) > i:
-                    if sp.has_dim_name(isl.ISL_DIM_TYPE.OUT, i):
-                        labels.append(sp.get_dim_name(isl.ISL_DIM_TYPE.OUT, i))
-                    else:
-                        labels.append("")
-            labels.reverse()
-        map_data.range().foreach_point(start_points.append)
-        for start in start_points:
-            end_points: List[isl.point] = []
-            limited = map_data.intersect_range(isl.set(start))
-            limited.domain().foreach_point(end_points.append)
-            s = get_point_coordinates(start, scale)
-            s.reverse()
-            all_start.append(s)
-            for end in end_points:
-                e = get_point_coordinates(end, scale)
-                e.reverse()
-                all_ends.append(e)
-                _plot_arrow(e,
-                            s,
-                            _plt, color=line_color, style=edge_style,
-                            width=edge_width, shrink=shrink)
-        _plt.plot([x[0] for x in all_start], [x[1]
-                  for x in all_start], "o", markersize=marker_size, color=start_color, lw=0)
-        _plt.plot([p[0] for p in all_ends], [p[1]
-                  for p in all_ends], "o", markersize=marker_size, color=end_color, lw=0)
+    sp = map.get_space()
+    for i in range(2):
+        if sp.dim(isl.ISL_DIM_TYPE.OUT) > i and sp.has_dim_name(isl.ISL_DIM_TYPE.OUT, i):
+            labels.append(sp.get_dim_name(isl.ISL_DIM_TYPE.OUT, i))
+        else:
+            labels.append("")
+    labels.reverse()
+
+    n_in = map.dim(isl.ISL_DIM_TYPE.IN)
+    edges = map_edges(map)
+    # The arrows point from the domain element to the range element.
+    all_ends = points_coordinates(edges[:, :n_in], scale)[:, ::-1]
+    all_start = points_coordinates(edges[:, n_in:], scale)[:, ::-1]
+    arrows = _thin_edges(np.hstack([all_ends, all_start]), max_edges)
+    head = _quiver_head(edge_style, edge_width)
+    if len(arrows) > batch_threshold and head is not None:
+        _plot_arrows(arrows[:, :2], arrows[:, 2:], _plt, head, color=line_color,
+                     width=edge_width, shrink=shrink)
+    else:
+        for e, s in zip(arrows[:, :2].tolist(), arrows[:, 2:].tolist()):
+            _plot_arrow(e,
+                        s,
+                        _plt, color=line_color, style=edge_style,
+                        width=edge_width, shrink=shrink)
+    # Many dependences share an end point, draw one marker per point.
+    all_start = np.unique(all_start, axis=0)
+    all_ends = np.unique(all_ends, axis=0)
+    _plt.plot(all_start[:, 0], all_start[:, 1], "o", markersize=marker_size, color=start_color, lw=0)
+    _plt.plot(all_ends[:, 0], all_ends[:, 1], "o", markersize=marker_size, color=end_color, lw=0)
     ax: _plt.Axes = _plt.gca()
     if labels[0] is not None:
         _plt.xlabel(labels[0])
@@ -161,6 +309,22 @@ def plot_bset_shape(bset_data: isl.basic_set, show_vertices=True, color="gray",
         vertex_color = color
 
     vertices = bset_get_vertex_coordinates(bset_data, scale=scale)
+    _plot_vertices_shape(vertices, show_vertices=show_vertices, color=color,
+                         alpha=alpha, vertex_color=vertex_color,
+                         vertex_marker=vertex_marker, vertex_size=vertex_size,
+                         border=border)
+
+
+def _plot_vertices_shape(vertices, show_vertices=True, color="gray", alpha=1.0,
+                         vertex_color=None, vertex_marker="o", vertex_size=10,
+                         border=0):
+    """
+    Plot the convex shape spanned by the given vertex coordinates, see
+    plot_bset_shape.
+    """
+
+    if not vertex_color:
+        vertex_color = color
 
     if show_vertices:
         dimX = [x[1] for x in vertices]
@@ -255,10 +419,12 @@ def plot_map_as_groups(bmap: isl.basic_map, processors_mapping: ProcessorMap=Non
         vertex_color = color
 
 
-    def plot_group_points(points: List[isl.point], region_color: str):
-      for point in points:
-        point_set = isl.basic_set(point)
-        part_set: isl.set = bmap.intersect_range(point_set).domain()
+    def plot_exact_group(group_set: isl.set, group_id, region_color):
+        point_set = group_set
+        for dim, value in enumerate(group_id):
+            point_set = point_set.lower_bound_si(isl.ISL_DIM_TYPE.SET, dim, int(value))
+            point_set = point_set.upper_bound_si(isl.ISL_DIM_TYPE.SET, dim, int(value))
+        part_set: isl.set = isl.map(bmap).intersect_range(point_set).domain()
         part_set_convex: isl.basic_set = part_set.convex_hull()
 
         # We currently expect that each group can be represented by a
@@ -274,19 +440,30 @@ def plot_map_as_groups(bmap: isl.basic_map, processors_mapping: ProcessorMap=Non
                         vertex_color=vertex_color,
                         vertex_size=vertex_size, vertex_marker=vertex_marker,
                         show_vertices=False, scale=scale, border=border)
-    
+
+    def plot_group_points(group_set: isl.set, region_color):
+        # The shape of all full groups is computed once and translated, only
+        # the groups clipped by the domain are computed one by one.
+        group_ids = set_points(group_set)
+        shapes = group_vertex_coordinates(bmap, group_ids, scale=scale)
+        for group_id, vertices in zip(group_ids, shapes):
+            if vertices is None:
+                plot_exact_group(group_set, group_id, region_color)
+                continue
+            _plot_vertices_shape(vertices, color=region_color, alpha=alpha,
+                                 vertex_color=vertex_color,
+                                 vertex_size=vertex_size,
+                                 vertex_marker=vertex_marker,
+                                 show_vertices=False, border=border)
+
     range: isl.set = bmap.range()
     if processors_mapping is None:
-      points: List[isl.point] = []
-      range.foreach_point(points.append)
-      plot_group_points(points, color)
+        plot_group_points(range, color)
     else:
-      colorbars = colormaps[color].resampled(len(processors_mapping.Range))
-      for processor_id in processors_mapping.Range:
-        processor_range = range.intersect(processors_mapping.Domain.intersect_params(isl.set(f"[P] -> {{ : P = {processor_id} }}")))
-        points: List[isl.point] = []
-        processor_range.foreach_point(points.append)
-        plot_group_points(points, colorbars(processor_id))
+        colorbars = colormaps[color].resampled(len(processors_mapping.Range))
+        for processor_id in processors_mapping.Range:
+            processor_range = range.intersect(processors_mapping.Domain.intersect_params(isl.set(f"[P] -> {{ : P = {processor_id} }}")))
+            plot_group_points(processor_range, colorbars(processor_id))
 
 
 def plot_domain(domain, dependences=None, tiling=None, space=None, processors_mapping:ProcessorMap=None,
@@ -296,7 +473,7 @@ def plot_domain(domain, dependences=None, tiling=None, space=None, processors_ma
                 bg_vertex_color="lightgray", bg_vertex_size=10,
                 bg_vertex_marker="o",
                 dep_color="gray", dep_style="->", dep_width=1,
-                shrink=6, border=0.15
+                shrink=6, border=0.15, dep_max_edges=None
                 ):
     """
     Plot an iteration space domain and related information.
@@ -324,6 +501,8 @@ def plot_domain(domain, dependences=None, tiling=None, space=None, processors_ma
                    around which is not plotted.
     :param border: Increase the size of the area filled with the background
                    by the value given as 'border'.
+    :param dep_max_edges: The maximal number of dependency arrows to draw, see
+                          plot_map.
     """
 
     if space:
@@ -335,9 +514,12 @@ def plot_domain(domain, dependences=None, tiling=None, space=None, processors_ma
             tiling = tiling.apply_domain(space)
 
     if background:
-        hull = get_rectangular_hull(domain, 1)
-        plot_set_points(hull, color=bg_vertex_color, size=bg_vertex_size,
-                        marker=bg_vertex_marker)
+        # The background grid is the padded bounding box, computed from the
+        # numeric bounds without building an isl set.
+        lo, hi = get_bounding_box(domain, 1)
+        grid = points_coordinates(box_points(lo, hi))
+        _plt.plot(grid[:, 1], grid[:, 0], bg_vertex_marker, markersize=bg_vertex_size,
+                  color=bg_vertex_color, lw=0)
 
     plot_set_points(domain, color=vertex_color, size=vertex_size,
                     marker=vertex_marker)
@@ -349,7 +531,7 @@ def plot_domain(domain, dependences=None, tiling=None, space=None, processors_ma
             same_tile = tiling.apply_range(tiling.reverse())
             dependences = dependences.subtract(same_tile)
         plot_map(dependences, line_color=dep_color, edge_style=dep_style,
-                 edge_width=dep_width, shrink=shrink)
+                 edge_width=dep_width, shrink=shrink, max_edges=dep_max_edges)
 
     if tiling:
         tiling = tiling.intersect_domain(domain)
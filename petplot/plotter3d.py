@@ -118,35 +118,19 @@ def plot_map_3d(map: Union[isl.map, isl.basic_map], edge_style="-|>", edge_width
     """
     if ax is None:
         ax = _plt.subplot(projection='3d')
-    if isinstance(map, isl.basic_map):
-        all_start: List[Tuple[int, int, int]] = []
-        all_ends: List[Tuple[int, int, int]] = []
-        start_points: List[isl.point] = []
-        map_datas: List[isl.basic_map] = []
-        map.foreach_basic_map(lambda bmap: map_datas.append(bmap))
-        for map_data in map_datas:
-            map_data.range().foreach_point(start_points.append)
-            for start in start_points:
-                end_points: List[isl.point] = []
-                limited = map_data.intersect_range(isl.set(start))
-                limited.domain().foreach_point(end_points.append)
-                s = get_point_coordinates(start, scale)
-                s.reverse()
-                all_start.append(s)
-                for end in end_points:
-                    e = get_point_coordinates(end, scale)
-                    e.reverse()
-                    all_ends.append(e)
-                    _plot_arrow(ax, s, [p[0] - p[1] for p in zip(e, s)],
-                                arrowstyle=edge_style, linewidth=edge_width, color=line_color, mutation_scale=edge_width*10,
-                                shrinkA=shrink, shrinkB=shrink)
-            ax.scatter([x[0] for x in all_start], [x[1] for x in all_start], [
-                       x[2] for x in all_start], color=start_color, marker="o", s=marker_size)
-            ax.scatter([x[0] for x in all_ends], [x[1] for x in all_ends], [
-                       x[2] for x in all_ends], color=end_color, marker="o", s=marker_size)
-    elif isinstance(map, isl.map):
-        map.foreach_basic_map(lambda bmap: plot_map_3d(
-            bmap, edge_style, edge_width, start_color, end_color, line_color, marker_size, scale, shrink, ax))
+    if isinstance(map, (isl.basic_map, isl.map)):
+        n_in = map.dim(isl.ISL_DIM_TYPE.IN)
+        edges = map_edges(map)
+        all_ends = (edges[:, :n_in] // scale)[:, ::-1]
+        all_start = (edges[:, n_in:] // scale)[:, ::-1]
+        for s, e in zip(all_start.tolist(), all_ends.tolist()):
+            _plot_arrow(ax, s, [p[0] - p[1] for p in zip(e, s)],
+                        arrowstyle=edge_style, linewidth=edge_width, color=line_color, mutation_scale=edge_width*10,
+                        shrinkA=shrink, shrinkB=shrink)
+        all_start = np.unique(all_start, axis=0)
+        all_ends = np.unique(all_ends, axis=0)
+        ax.scatter(all_start[:, 0], all_start[:, 1], all_start[:, 2], color=start_color, marker="o", s=marker_size)
+        ax.scatter(all_ends[:, 0], all_ends[:, 1], all_ends[:, 2], color=end_color, marker="o", s=marker_size)
     elif isinstance(map, isl.union_map):
         map.foreach_map(lambda bmap: plot_map_3d(
             bmap, edge_style, edge_width, start_color, end_color, line_color, marker_size, scale, shrink, ax))
@@ -0,0 +1,288 @@
+import numpy as np
+from typing import Iterable, Iterator, Optional, Sequence
+
+
+def _last_nonzero(rows: np.ndarray) -> np.ndarray:
+    """
+    Return for each constraint row the index of its last variable with a
+    non-zero coefficient, or -1 if the row only has a constant term.
+    """
+    if rows.shape[1] == 1:
+        return np.full(len(rows), -1)
+    nonzero = rows[:, 1:] != 0
+    last = nonzero.shape[1] - 1 - np.argmax(nonzero[:, ::-1], axis=1)
+    last[~nonzero.any(axis=1)] = -1
+    return last
+
+
+def _expand(prefix: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+    """
+    Append one dimension to every row of prefix, enumerating the values
+    lo[i] .. hi[i] for row i. Rows stay in lexicographic order.
+    """
+    counts = np.maximum(hi - lo + 1, 0)
+    total = int(counts.sum())
+    starts = np.cumsum(counts) - counts
+    offsets = np.arange(total, dtype=np.int64) - np.repeat(starts, counts)
+    values = np.repeat(lo, counts) + offsets
+    return np.hstack([np.repeat(prefix, counts, axis=0), values[:, None]])
+
+
+def _level_bounds(prefix: np.ndarray, eqs: np.ndarray, ineqs: np.ndarray,
+                  eq_last: np.ndarray, ineq_last: np.ndarray, level: int,
+                  lo: np.ndarray, hi: np.ndarray, bounded: bool):
+    """
+    Tighten the bounds of variable 'level' for every prefix row using the
+    constraints whose last variable is 'level'.
+    """
+    lo = lo.copy()
+    hi = hi.copy()
+    has_lo = np.full(len(prefix), bounded)
+    has_hi = np.full(len(prefix), bounded)
+    for row in ineqs[ineq_last == level]:
+        a = row[1 + level]
+        rest = row[0] + prefix @ row[1:1 + level]
+        if a > 0:
+            # a * x + rest >= 0  =>  x >= ceil(-rest / a)
+            lo = np.where(has_lo, np.maximum(lo, -(rest // a)), -(rest // a))
+            has_lo[:] = True
+        else:
+            # x <= floor(rest / -a)
+            hi = np.where(has_hi, np.minimum(hi, rest // -a), rest // -a)
+            has_hi[:] = True
+    for row in eqs[eq_last == level]:
+        a = row[1 + level]
+        rest = row[0] + prefix @ row[1:1 + level]
+        value = -rest // a
+        exact = rest % a == 0
+        lo = np.where(has_lo, np.maximum(lo, value), value)
+        hi = np.where(has_hi, np.minimum(hi, value), value)
+        hi = np.where(exact, hi, lo - 1)
+        has_lo[:] = True
+        has_hi[:] = True
+    if len(prefix) and not (has_lo.all() and has_hi.all()):
+        raise ValueError("can not enumerate an unbounded set")
+    return lo, hi
+
+
+def _pieces(prefix: np.ndarray, lo: np.ndarray, hi: np.ndarray,
+            block: Optional[int]) -> Iterator[np.ndarray]:
+    """
+    Expand prefix by one dimension in pieces of at most 'block' rows, in
+    lexicographic order. A single row whose range is larger than 'block' is
+    split into several sub-ranges.
+    """
+    if block is None:
+        yield _expand(prefix, lo, hi)
+        return
+    counts = np.maximum(hi - lo + 1, 0)
+    cum = np.cumsum(counts)
+    i, n = 0, len(prefix)
+    while i < n:
+        if counts[i] > block:
+            for start in range(int(lo[i]), int(hi[i]) + 1, block):
+                end = min(int(hi[i]), start + block - 1)
+                yield _expand(prefix[i:i + 1], np.array([start]), np.array([end]))
+            i += 1
+            continue
+        base = cum[i - 1] if i > 0 else 0
+        j = int(np.searchsorted(cum, base + block, side='right'))
+        big = np.nonzero(counts[i:j] > block)[0]
+        if len(big):
+            j = i + int(big[0])
+        yield _expand(prefix[i:j], lo[i:j], hi[i:j])
+        i = j
+
+
+def _rechunk(chunks: Iterable[np.ndarray], n_dims: int, chunk_size: Optional[int]) -> Iterator[np.ndarray]:
+    """
+    Regroup a stream of point arrays into arrays of exactly chunk_size rows,
+    except for the last one.
+    """
+    if chunk_size is None:
+        for chunk in chunks:
+            if len(chunk):
+                yield chunk
+        return
+    buffer, size = [], 0
+    for chunk in chunks:
+        while len(chunk):
+            take = min(chunk_size - size, len(chunk))
+            buffer.append(chunk[:take])
+            size += take
+            chunk = chunk[take:]
+            if size == chunk_size:
+                yield np.vstack(buffer)
+                buffer, size = [], 0
+    if size:
+        yield np.vstack(buffer)
+
+
+def iter_scan_points(eqs: np.ndarray, ineqs: np.ndarray, lo: Sequence[int], hi: Sequence[int],
+                     chunk_size: Optional[int] = 65536) -> Iterator[np.ndarray]:
+    """
+    Enumerate the integer points of a basic set given by its constraint
+    matrices, as a stream of int64 arrays of shape (chunk_size, n_dims).
+
+    eqs and ineqs are two dimensional arrays whose columns are the constant
+    term followed by the set dimensions and then the existentially quantified
+    (div) variables; all parameters must already be substituted. lo and hi are
+    inclusive bounds of the set dimensions. Every dimension is scanned level
+    by level, using the constraints whose last variable is the current one to
+    narrow the bounds. Div variables are scanned as trailing dimensions, so
+    they must be bounded by the constraints, and are projected out at the end.
+
+    The scan is depth first over blocks of at most chunk_size rows per level,
+    so the points come out in lexicographic order without a final sort and
+    the memory use does not depend on the size of the set.
+
+    :param eqs: The equality constraints, one per row.
+    :param ineqs: The inequality constraints (row . (1, x) >= 0), one per row.
+    :param lo: The lower bound of each set dimension.
+    :param hi: The upper bound of each set dimension.
+    :param chunk_size: The number of points per chunk. None scans every level
+                       in one block.
+    """
+    n_dims = len(lo)
+    eqs = np.asarray(eqs, dtype=np.int64)
+    ineqs = np.asarray(ineqs, dtype=np.int64)
+    n_vars = eqs.shape[1] - 1
+    eq_last = _last_nonzero(eqs)
+    ineq_last = _last_nonzero(ineqs)
+    # Constraints without variables are either trivially true or make the
+    # set empty.
+    if (eqs[eq_last == -1, 0] != 0).any() or (ineqs[ineq_last == -1, 0] < 0).any():
+        return
+
+    def scan(prefix: np.ndarray, level: int) -> Iterator[np.ndarray]:
+        if level == n_vars:
+            yield prefix[:, :n_dims]
+            return
+        bounded = level < n_dims
+        m = len(prefix)
+        lo_k = np.full(m, lo[level] if bounded else 0, dtype=np.int64)
+        hi_k = np.full(m, hi[level] if bounded else -1, dtype=np.int64)
+        lo_k, hi_k = _level_bounds(prefix, eqs, ineqs, eq_last, ineq_last, level, lo_k, hi_k, bounded)
+        for piece in _pieces(prefix, lo_k, hi_k, chunk_size):
+            if len(piece):
+                yield from scan(piece, level + 1)
+
+    def unique(chunks: Iterator[np.ndarray]) -> Iterator[np.ndarray]:
+        # Several values of the div variables may map to the same point. They
+        # are adjacent since the points are in lexicographic order.
+        last = None
+        for points in chunks:
+            keep = np.ones(len(points), dtype=bool)
+            keep[1:] = (points[1:] != points[:-1]).any(axis=1)
+            if last is not None:
+                keep[0] = (points[0] != last).any()
+            last = points[-1]
+            yield points[keep]
+
+    chunks = scan(np.zeros((1, 0), dtype=np.int64), 0)
+    if n_vars > n_dims:
+        chunks = unique(chunks)
+    yield from _rechunk(chunks, n_dims, chunk_size)
+
+
+def scan_points(eqs: np.ndarray, ineqs: np.ndarray, lo: Sequence[int], hi: Sequence[int]) -> np.ndarray:
+    """
+    Enumerate all integer points of a basic set at once, see iter_scan_points.
+
+    :returns: An int64 array of shape (n_points, n_dims) in lexicographic
+              order.
+    """
+    chunks = list(iter_scan_points(eqs, ineqs, lo, hi, chunk_size=None))
+    if len(chunks) == 0:
+        return np.zeros((0, len(lo)), dtype=np.int64)
+    return chunks[0] if len(chunks) == 1 else np.vstack(chunks)
+
+
+def _lex_le(points: np.ndarray, bound: np.ndarray) -> np.ndarray:
+    """ Return which rows of points are lexicographically smaller or equal to bound. """
+    if points.shape[1] == 0:
+        return np.ones(len(points), dtype=bool)
+    diff = points != bound
+    first = np.argmax(diff, axis=1)
+    return ~diff.any(axis=1) | (points[np.arange(len(points)), first] < bound[first])
+
+
+def _lex_sort(points: np.ndarray, unique: bool) -> np.ndarray:
+    if unique:
+        return np.unique(points, axis=0)
+    return points[np.lexsort(points.T[::-1])] if points.shape[1] else points
+
+
+def iter_merge_points(streams: Sequence[Iterable[np.ndarray]], n_dims: int,
+                      chunk_size: Optional[int] = 65536, unique: bool = True) -> Iterator[np.ndarray]:
+    """
+    Merge several streams of lexicographically ordered point chunks into one
+    ordered stream (a k-way merge on chunks).
+
+    All points that are not larger than the smallest last point of the
+    buffered chunks are final and are emitted; a stream whose buffer runs
+    empty pulls its next chunk.
+
+    :param streams: The point streams, e.g. one per disjunct.
+    :param n_dims: The number of dimensions of the points.
+    :param chunk_size: The number of points per output chunk.
+    :param unique: Drop points that occur in several streams.
+    """
+    iterators = [iter(s) for s in streams]
+    buffers = [np.zeros((0, n_dims), dtype=np.int64) for _ in iterators]
+    active = list(range(len(iterators)))
+
+    def merged() -> Iterator[np.ndarray]:
+        while True:
+            for k in list(active):
+                while len(buffers[k]) == 0:
+                    chunk = next(iterators[k], None)
+                    if chunk is None:
+                        active.remove(k)
+                        break
+                    buffers[k] = chunk
+            if not active:
+                break
+            lasts = np.array([buffers[k][-1] for k in active]).reshape(len(active), n_dims)
+            bound = lasts[np.lexsort(lasts.T[::-1])[0]] if n_dims else lasts[0]
+            ready = []
+            for k, buffer in enumerate(buffers):
+                if len(buffer) == 0:
+                    continue
+                n = int(np.count_nonzero(_lex_le(buffer, bound)))
+                ready.append(buffer[:n])
+                buffers[k] = buffer[n:]
+            yield _lex_sort(np.vstack(ready), unique)
+        rest = [b for b in buffers if len(b)]
+        if rest:
+            yield _lex_sort(np.vstack(rest), unique)
+
+    yield from _rechunk(merged(), n_dims, chunk_size)
+
+
+def box_points(lo: Sequence[int], hi: Sequence[int]) -> np.ndarray:
+    """
+    Return all integer points of the box lo <= x <= hi as an int64 array of
+    shape (n_points, n_dims) in lexicographic order.
+    """
+    axes = [np.arange(l, h + 1, dtype=np.int64) for l, h in zip(lo, hi)]
+    if len(axes) == 0:
+        return np.zeros((1, 0), dtype=np.int64)
+    grid = np.meshgrid(*axes, indexing='ij')
+    return np.stack(grid, axis=-1).reshape(-1, len(axes))
+
+
+def merge_points(arrays: Sequence[np.ndarray], n_dims: int) -> np.ndarray:
+    """
+    Merge the point arrays of several disjuncts into one array of unique
+    points in lexicographic order.
+    """
+    arrays = [a for a in arrays if len(a)]
+    if len(arrays) == 0:
+        return np.zeros((0, n_dims), dtype=np.int64)
+    if len(arrays) == 1:
+        return arrays[0]
+    return np.unique(np.vstack(arrays), axis=0)
+
+
+__all__ = ['scan_points', 'iter_scan_points', 'merge_points', 'iter_merge_points', 'box_points']
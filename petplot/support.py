@@ -1,6 +1,8 @@
 import isl
 import numpy as np
-from typing import Tuple, List
+from typing import Iterator, Tuple, List
+from petplot.points import scan_points, iter_scan_points, merge_points, iter_merge_points
+from petplot.cache import cached
 
 
 def get_point_coordinates(point: isl.point, scale=1) -> List[int]:
@@ -52,38 +54,37 @@ def _vertex_get_coordinates(vertex, scale=1) -> List[float]:
   return [(1.0 * x[0] / x[1]) / scale for x in r]
 
 
-def _is_vertex_on_constraint(vertex, constraint):
+def _vertex_matrix(vertices) -> np.ndarray:
   """
-  Given a vertex and a constraint, check if the vertex is on the plane defined
-  by the constraint. For inequality constraints, the plane we look at is the
-  extremal plane that separates the elements that fulfill an inequality
-  constraint from the elements that do not fulfill this constraints.
+  Return the vertices as an integer matrix of homogeneous coordinates. Row i
+  is (d, n_0, ..., n_k) such that n_j / d is coordinate j of vertex i.
   """
-  r = _vertex_to_rational_point(vertex)
-
-  dims = constraint.space.dim(isl.ISL_DIM_TYPE.SET)
-  v = []
-  for d in range(dims):
-    v.append(constraint.get_coefficient_val(isl.ISL_DIM_TYPE.SET, d).get_num_si())
-
-  summ = 0
-
-  import numpy
-  for i in range(dims):
-    prod = 1
-    for j in range(dims):
-      if i == j:
-        prod *= r[j][0]
-      else:
-        prod *= r[j][1]
-    summ += v[i] * prod
+  rational = [_vertex_to_rational_point(v) for v in vertices]
+  n = len(rational[0]) if rational else 0
+  result = np.zeros((len(rational), 1 + n), dtype=np.int64)
+  for i, r in enumerate(rational):
+    den = 1
+    for _, d in r:
+      den = den * d // gcd(den, d)
+    result[i, 0] = den
+    result[i, 1:] = [num * (den // d) for num, d in r]
+  return result
 
-  constant = constraint.get_constant_val().get_num_si()
-  summ += numpy.product([x[1] for x in r]) * constant
 
-  return int(summ) == 0
+def _face_constraint_matrix(bset_data: isl.basic_set) -> np.ndarray:
+  """
+  Return the constant and set coefficients of all constraints of a basic
+  set, one row per constraint, equalities first.
+  """
+  types = (isl.ISL_DIM_TYPE.CST, isl.ISL_DIM_TYPE.SET,
+           isl.ISL_DIM_TYPE.PARAM, isl.ISL_DIM_TYPE.DIV)
+  n = bset_data.dim(isl.ISL_DIM_TYPE.SET)
+  return np.vstack([_mat_to_numpy(mat)[:, :1 + n]
+                    for mat in (bset_data.equalities_matrix(*types),
+                                bset_data.inequalities_matrix(*types))])
 
 
+@cached
 def bset_get_vertex_coordinates(bset_data: isl.basic_set, scale=1):
   """
   Given a basic set return the list of vertices at the corners.
@@ -122,6 +123,7 @@ def bset_get_vertex_coordinates(bset_data: isl.basic_set, scale=1):
 from math import sqrt
 from math import degrees
 from math import acos
+from math import gcd
 
 
 def cross(a, b):
@@ -172,6 +174,21 @@ def angle(Q, M, O, N):
     return -formular(OQ, OM)
 
 
+def _order_face(points) -> List[int]:
+  """
+  Given the lexicographically ordered, distinct vertices of a face, return
+  the order of their positions such that connecting subsequent vertices
+  yields a convex shape.
+  """
+  if len(points) <= 2:
+    return list(range(len(points)))
+  A, B, C = points[:3]
+  N = norm(A, B, C)
+  center = [(A[0] + B[0]) / 2, (A[1] + B[1]) / 2, (A[2] + B[2]) / 2]
+  def f(k): return angle(A, points[k], center, N)
+  return sorted(range(len(points)), key=f)
+
+
 def get_vertices_for_constraint(vertices, constraint):
   """
   Return the list of vertices within a hyperspace.
@@ -181,10 +198,13 @@ def get_vertices_for_constraint(vertices, constraint):
   are returned. We then sort the vertices such that the order defines a
   convex shape.
   """
-  points = []
-  for v in vertices:
-    if _is_vertex_on_constraint(v, constraint):
-      points.append(_vertex_get_coordinates(v))
+  dims = constraint.space.dim(isl.ISL_DIM_TYPE.SET)
+  row = np.array([constraint.get_constant_val().get_num_si()] +
+                 [constraint.get_coefficient_val(isl.ISL_DIM_TYPE.SET, d).get_num_si()
+                  for d in range(dims)], dtype=np.int64)
+  homogeneous = _vertex_matrix(vertices)
+  on_plane = homogeneous @ row == 0 if len(vertices) else np.zeros(0, dtype=bool)
+  points = (homogeneous[on_plane, 1:] / homogeneous[on_plane, :1]).tolist()
 
   if len(points) == 0:
     return None
@@ -192,35 +212,50 @@ def get_vertices_for_constraint(vertices, constraint):
   points.sort()
   import itertools
   points = list(points for points, _ in itertools.groupby(points))
+  return [points[k] for k in _order_face(points)]
 
-  A = points[0]
-  if len(points) == 1:
-    return [A]
-  B = points[1]
-  if len(points) == 2:
-    return [A, B]
-  C = points[2]
-  N = norm(A, B, C)
-  center = [(A[0] + B[0]) / 2, (A[1] + B[1]) / 2, (A[2] + B[2]) / 2]
-  def f(a): return angle(A, a, center, N)
-  points = sorted(points, key=f)
-  return points
-
-
-def isSubset(parent, child):
-  if len(parent) <= len(child):
-    return False
-  for c in child:
-    contained = False
-    for p in parent:
-      if p == c:
-        contained = True
-        break
 
-    if not contained:
-      return False
+def _bset_faces(basicSet: isl.basic_set):
+  """
+  Return the distinct vertex coordinates of a basic set and its faces as
+  lists of vertex indices, ordered as bset_get_faces returns them.
+
+  The vertices and the constraints are extracted once as integer matrices,
+  vertex i lies on constraint k iff the exact product of row k of the
+  constraints with the homogeneous coordinates of vertex i is zero. A face is
+  the set of vertices on one constraint; duplicate faces and faces that are
+  contained in a larger one are dropped.
+  """
+  vertices = []
+  basicSet.compute_vertices().foreach_vertex(vertices.append)
+  if len(vertices) == 0:
+    return [], []
+  homogeneous = np.unique(_vertex_matrix(vertices), axis=0)
+  coordinates = (homogeneous[:, 1:] / homogeneous[:, :1]).tolist()
+
+  incidence = _face_constraint_matrix(basicSet) @ homogeneous.T == 0
+  unique = {}
+  for mask in incidence:
+    if mask.any():
+      unique.setdefault(mask.tobytes(), mask)
+  if len(unique) == 0:
+    return coordinates, []
+  masks = np.array(list(unique.values()))
+  counts = masks.astype(np.int64)
+  sizes = counts.sum(axis=1)
+  # Face i is a proper subset of face j iff all of its vertices are on j
+  # and j has more of them.
+  common = counts @ counts.T
+  subset = (common == sizes[:, None]) & (sizes[None, :] > sizes[:, None])
+  masks = masks[~subset.any(axis=1)]
 
-  return True
+  faces = []
+  for mask in masks:
+    indices = sorted(np.nonzero(mask)[0].tolist(), key=lambda i: coordinates[i])
+    order = _order_face([coordinates[i] for i in indices])
+    faces.append([indices[k] for k in order])
+  faces.sort(key=lambda face: [coordinates[i] for i in face])
+  return coordinates, faces
 
 
 def bset_get_faces(basicSet: isl.basic_set):
@@ -233,21 +268,8 @@ def bset_get_faces(basicSet: isl.basic_set):
   Vertices may have rational coordinates. A vertice is represented as a three
   tuple.
   """
-  faces = []
-  vertices = []
-  basicSet.compute_vertices().foreach_vertex(vertices.append)
-  def f(c): return faces.append(get_vertices_for_constraint(vertices, c))
-  basicSet.foreach_constraint(f)
-
-  # Remove empty elements, duplicates and subset of elements
-  faces = filter(lambda x: not x == None, faces)
-  faces = list(faces)
-  faces = [x for x in faces if not
-           any(isSubset(y, x) for y in faces if x is not y)]
-  faces.sort()
-  import itertools
-  faces = list(faces for faces, _ in itertools.groupby(faces))
-  return faces
+  coordinates, faces = _bset_faces(basicSet)
+  return [[coordinates[i] for i in face] for face in faces]
 
 
 def set_get_faces(set_data):
@@ -267,34 +289,7 @@ def set_get_faces(set_data):
   return list(map(bset_get_faces, bsets))
 
 
-def make_tuple(vertex):
-  return (vertex[0], vertex[1], vertex[2])
-
-
-def get_vertex_to_index_map(vertexlist):
-  res = {}
-  i = 0
-  for v in vertexlist:
-    res[make_tuple(v)] = i
-    i += 1
-  return res
-
-
-def translate_faces_to_indexes(faces, vertexmap):
-  """
-  Given a list of faces, translate the vertex defining it from their explit
-  offsets to their index as provided by the vertexmap, a mapping from vertices
-  to vertex indices.
-  """
-  new_faces = []
-  for face in faces:
-    new_face = []
-    for vertex in face:
-      new_face.append(vertexmap[make_tuple(vertex)])
-    new_faces.append(new_face)
-  return new_faces
-
-
+@cached
 def get_vertices_and_faces(set_data):
   """
   Given an isl set, return a tuple that contains the vertices and faces of
@@ -303,18 +298,16 @@ def get_vertices_and_faces(set_data):
   vertices of a face are sorted such that connecting subsequent vertices
   yields a convex form.
   """
-  data = set_get_faces(set_data)
-  if len(data) == 0:
+  bsets = []
+  set_data.foreach_basic_set(bsets.append)
+  if len(bsets) == 0:
     return ([], [])
 
-  faces = data[0]
-  vertices = [vertex for face in faces for vertex in face]
-  vertices.sort()
-  import itertools
-  vertices = list(vertices for vertices, _ in itertools.groupby(vertices))
-  vertexmap = get_vertex_to_index_map(vertices)
-
-  faces = translate_faces_to_indexes(faces, vertexmap)
+  coordinates, faces = _bset_faces(bsets[0])
+  used = sorted({i for face in faces for i in face}, key=lambda i: coordinates[i])
+  index = {i: position for position, i in enumerate(used)}
+  vertices = [coordinates[i] for i in used]
+  faces = [[index[i] for i in face] for face in faces]
   return (vertices, faces)
 
 
@@ -332,6 +325,7 @@ def _constraint_make_equality_set(x):
   return isl.basic_set.universe(x.space).add_constraint(e)
 
 
+@cached
 def bset_get_points(bset_data, only_hull=False, scale=1) -> List[List[int]]:
   """
   Given a basic set return the points within this set
@@ -342,6 +336,10 @@ def bset_get_points(bset_data, only_hull=False, scale=1) -> List[List[int]]:
   """
 
   if only_hull:
+    points = _hull_points(bset_data)
+    if points is not None:
+      return points_coordinates(points, scale).tolist()
+
     hull = [None]
     hull[0] = isl.set.empty(bset_data.space)
 
@@ -352,90 +350,401 @@ def bset_get_points(bset_data, only_hull=False, scale=1) -> List[List[int]]:
     bset_data.foreach_constraint(add)
     bset_data = hull[0]
 
-  points = []
-  def f(x): return points.append(get_point_coordinates(x, scale))
-  bset_data.foreach_point(f)
-  points = sorted(points)
+  return points_coordinates(set_points(bset_data), scale).tolist()
+
+
+def _hull_points(set_data):
+  """
+  Return the points of a (basic) set that make at least one constraint of
+  their basic set tight, in lexicographic order.
+
+  The points are enumerated once and checked against the constraint
+  matrices, instead of intersecting the set with one equality per
+  constraint. Returns None if a basic set has existentially quantified
+  variables, whose values are not known for the enumerated points.
+  """
+  bsets = []
+  isl.set(set_data).foreach_basic_set(bsets.append)
+  n = set_data.dim(isl.ISL_DIM_TYPE.SET)
+  param_values = _param_values(isl.set(set_data))
+  arrays = []
+  for bset in bsets:
+    eqs, ineqs = _constraint_matrices(bset, param_values)
+    if eqs.shape[1] != 1 + n:
+      return None
+    points = set_points(bset)
+    homogeneous = np.hstack([np.ones((len(points), 1), dtype=np.int64), points])
+    tight = ((homogeneous @ eqs.T == 0).any(axis=1) |
+             (homogeneous @ ineqs.T == 0).any(axis=1))
+    arrays.append(points[tight])
+  return merge_points(arrays, n)
+
+
+def points_coordinates(points: np.ndarray, scale=1) -> np.ndarray:
+  """
+  Scale an array of points the way get_point_coordinates scales a single
+  point. Points of fewer than two dimensions, such as the empty array of an
+  empty union set, get zero coordinates up to two dimensions.
+
+  :param points: The (n_points, n_dims) array of points.
+  :param scale: Scale the values.
+  """
+  points = points // scale
+  if points.shape[1] < 2:
+    points = _pad_points(points, 2)
   return points
 
 
-def get_rectangular_hull(set_data: isl.set, offset=0):
-  uset_data = isl.set.universe(set_data.get_space())
+def _mat_to_numpy(mat: isl.mat) -> np.ndarray:
+  out = np.zeros((mat.rows(), mat.cols()), dtype=np.int64)
+  for i in range(mat.rows()):
+    for j in range(mat.cols()):
+      out[i, j] = mat.get_element_val(i, j).get_num_si()
+  return out
 
-  for dim in range(0, 2):
-    ls = isl.local_space.from_space(set_data.get_space())
-    c = isl.constraint.alloc_inequality(ls)
-    incr = isl.map("{{[i]->[i+{0}]}}".format(offset))
-    decr = isl.map("{{[i]->[i-{0}]}}".format(offset))
 
-    dim_val = isl.aff.zero_on_domain(ls).set_coefficient_si(isl.ISL_DIM_TYPE.IN, dim, 1)
-    dim_val = isl.pw_aff(dim_val)
-    dim_val = dim_val.as_map()
+def _val_to_int(val: isl.val) -> int:
+  if not val.is_int():
+    raise ValueError("can not enumerate an unbounded set")
+  return val.get_num_si()
 
-    space = dim_val.get_space()
-    dim_cst = isl.map.universe(space)
-    max_set = isl.set.from_pw_aff(set_data.dim_max(dim))
-    dim_cst = dim_cst.intersect_range(max_set)
-    dim_cst = dim_cst.apply_range(incr)
 
-    diff = isl.map.lex_le_map(dim_val, dim_cst)
-    uset_data = uset_data.intersect(diff.domain())
+def _param_values(set_data: isl.set) -> np.ndarray:
+  """
+  Return the values of the parameters of a set. The parameters must be fixed,
+  e.g. by intersect_params.
+  """
+  n = set_data.dim(isl.ISL_DIM_TYPE.PARAM)
+  if n == 0:
+    return np.zeros(0, dtype=np.int64)
+  params = set_data.params()
+  if not params.is_singleton():
+    raise ValueError("the parameters must be fixed, use intersect_params first")
+  point = params.sample_point()
+  return np.array([point.get_coordinate_val(isl.ISL_DIM_TYPE.PARAM, i).get_num_si()
+                   for i in range(n)], dtype=np.int64)
+
+
+def _constraint_matrices(data, param_values: np.ndarray):
+  """
+  Return the equality and inequality matrices of a basic set (columns CST,
+  SET, DIV) or basic map (columns CST, IN, OUT, DIV) with the parameters
+  substituted by their values.
+  """
+  if isinstance(data, isl.basic_map):
+    types = (isl.ISL_DIM_TYPE.CST, isl.ISL_DIM_TYPE.PARAM, isl.ISL_DIM_TYPE.IN,
+             isl.ISL_DIM_TYPE.OUT, isl.ISL_DIM_TYPE.DIV)
+  else:
+    types = (isl.ISL_DIM_TYPE.CST, isl.ISL_DIM_TYPE.PARAM,
+             isl.ISL_DIM_TYPE.SET, isl.ISL_DIM_TYPE.DIV)
+  n = len(param_values)
+  result = []
+  for mat in (data.equalities_matrix(*types), data.inequalities_matrix(*types)):
+    m = _mat_to_numpy(mat)
+    m[:, 0] += m[:, 1:1 + n] @ param_values
+    result.append(np.delete(m, np.s_[1:1 + n], axis=1))
+  return tuple(result)
 
-    dim_cst = isl.map.universe(space)
-    min_set = isl.set.from_pw_aff(set_data.dim_min(dim))
-    dim_cst = dim_cst.intersect_range(min_set)
-    dim_cst = dim_cst.apply_range(decr)
 
-    diff = isl.map.lex_ge_map(dim_val, dim_cst)
-    uset_data = uset_data.intersect(diff.domain())
+def _numpy_to_mat(array: np.ndarray) -> isl.mat:
+  # Imported lazily, common pulls in pet which the Blender frontend lacks.
+  from common import numpy_to_isl_mat
+  return numpy_to_isl_mat(array)
 
-  return uset_data
 
+@cached
+def set_bounds(set_data) -> Tuple[np.ndarray, np.ndarray]:
+  """
+  Return the inclusive lower and upper bound of every set dimension, one
+  dim_min_val/dim_max_val per dimension.
 
-def cmp_points(a, b):
-  a = isl.set.from_point(a)
-  b = isl.set.from_point(b)
-  if a.lex_le_set(b).is_empty():
-    return 1
-  else:
-    return -1
+  :param set_data: The (basic|union|) set, its parameters must be fixed. The
+                   bounds of a union set cover all of its sets.
+  """
+  return _set_bounds(set_data)
+
+
+def _set_bounds(set_data) -> Tuple[np.ndarray, np.ndarray]:
+  if isinstance(set_data, isl.union_set):
+    sets = _union_set_list(set_data)
+    if len(sets) == 0:
+      raise ValueError("can not bound an empty union set")
+    n_dims = _union_set_dim(sets)
+    bounds = [[_pad_points(b[None, :], n_dims)[0] for b in _set_bounds(x)] for x in sets]
+    return (np.min([b[0] for b in bounds], axis=0),
+            np.max([b[1] for b in bounds], axis=0))
+  if isinstance(set_data, isl.basic_set):
+    set_data = isl.set(set_data)
+  n = set_data.dim(isl.ISL_DIM_TYPE.SET)
+  lo = np.array([_val_to_int(set_data.dim_min_val(i)) for i in range(n)], dtype=np.int64)
+  hi = np.array([_val_to_int(set_data.dim_max_val(i)) for i in range(n)], dtype=np.int64)
+  return lo, hi
+
+
+def _set_scan_args(set_data) -> Tuple[int, list]:
+  """
+  Return the number of dimensions of a (basic) set and the scan_points
+  arguments (eqs, ineqs, lo, hi) of each of its non-empty basic sets.
+  """
+  if isinstance(set_data, isl.basic_set):
+    set_data = isl.set(set_data)
+  param_values = _param_values(set_data)
+  bsets = []
+  set_data.foreach_basic_set(bsets.append)
+  args = []
+  for bset in bsets:
+    if bset.is_empty():
+      continue
+    lo, hi = _set_bounds(bset)
+    eqs, ineqs = _constraint_matrices(bset, param_values)
+    args.append((eqs, ineqs, lo, hi))
+  return set_data.dim(isl.ISL_DIM_TYPE.SET), args
+
+
+def _union_set_list(set_data: isl.union_set) -> List[isl.set]:
+  sets = []
+  set_data.foreach_set(sets.append)
+  return sets
+
+
+def _union_set_dim(sets: List[isl.set]) -> int:
+  return max((x.dim(isl.ISL_DIM_TYPE.SET) for x in sets), default=0)
+
+
+def _pad_points(points: np.ndarray, n_dims: int) -> np.ndarray:
+  """
+  Append zero coordinates to points of fewer than n_dims dimensions.
+  """
+  if points.shape[1] == n_dims:
+    return points
+  return np.hstack([points, np.zeros((len(points), n_dims - points.shape[1]), dtype=points.dtype)])
+
+
+@cached
+def set_points(set_data) -> np.ndarray:
+  """
+  Return the integer points of a set as an int64 array of shape
+  (n_points, n_dims) in lexicographic order.
+
+  Instead of calling back into Python for every point, the bounds and the
+  constraint matrices of every basic set are extracted once and the points
+  are enumerated with numpy.
+
+  :param set_data: The (basic|union|) set, its parameters must be fixed. The
+                   points of a union set are padded with zero coordinates to
+                   the largest number of dimensions of its sets.
+  """
+  return _set_points(set_data)
+
+
+def _set_points(set_data) -> np.ndarray:
+  if isinstance(set_data, isl.union_set):
+    sets = _union_set_list(set_data)
+    if len(sets) == 0:
+      return np.zeros((0, set_data.get_space().dim(isl.ISL_DIM_TYPE.SET)), dtype=np.int64)
+    # Every set is enumerated on its own, only the padded arrays are merged.
+    n_dims = _union_set_dim(sets)
+    points = np.vstack([_pad_points(_set_points(x), n_dims) for x in sets])
+    return points[np.lexsort(points.T[::-1])] if points.shape[1] else points
+  n_dims, args = _set_scan_args(set_data)
+  return merge_points([scan_points(*a) for a in args], n_dims)
+
+
+def iter_set_points(set_data, chunk_size=65536) -> Iterator[np.ndarray]:
+  """
+  Yield the integer points of a set in lexicographic order as int64 arrays
+  of chunk_size rows (the last one may be shorter).
+
+  Each basic set is scanned depth first in blocks and the disjuncts are
+  merged chunk by chunk, so the memory use stays constant for huge domains
+  and the first points are available immediately.
+
+  :param set_data: The (basic|union|) set, its parameters must be fixed. The
+                   points of a union set are padded as in set_points.
+  :param chunk_size: The number of points per chunk.
+  """
+  if isinstance(set_data, isl.union_set):
+    sets = _union_set_list(set_data)
+    if len(sets) == 0:
+      return
+    n_dims = _union_set_dim(sets)
+    streams = [(_pad_points(c, n_dims) for c in iter_set_points(x, chunk_size)) for x in sets]
+    # Points of different spaces may coincide, keep all of them.
+    yield from iter_merge_points(streams, n_dims, chunk_size, unique=False)
+    return
+  n_dims, args = _set_scan_args(set_data)
+  streams = [iter_scan_points(*a, chunk_size=chunk_size) for a in args]
+  if len(streams) == 1:
+    yield from streams[0]
+  elif len(streams) > 1:
+    yield from iter_merge_points(streams, n_dims, chunk_size)
+
+
+@cached
+def map_edges(map_data) -> np.ndarray:
+  """
+  Return the relation of a map as an int64 array of shape
+  (n_edges, n_in + n_out). Each row holds the coordinates of a source point
+  followed by the coordinates of the target point, in lexicographic order.
+
+  The wrapped relation is enumerated once instead of enumerating one side and
+  intersecting the map with every single point.
+
+  :param map_data: The (basic|union|) map, its parameters must be fixed. The
+                   maps in a union must have the same number of dimensions.
+  """
+  return _set_points(map_data.wrap())
 
 
-def cmp_to_key(mycmp):
-  'Convert a cmp= function into a key= function'
-  class Key(object):
-    def __init__(self, obj, *args):
-      self.obj = obj
+def group_vertex_coordinates(bmap, group_ids: np.ndarray, scale=1) -> List[np.ndarray]:
+  """
+  Return for every group id the ordered vertex coordinates of its group,
+  as bset_get_vertex_coordinates returns them for
+  bmap.intersect_range(id).domain().
+
+  The shape is computed once with the group coordinates t as parameters:
+  if the constraints that involve t are a translate A x + B t + c >= 0 with
+  B = -A D, the vertices of group t are the vertices of group 0 moved by D t.
+  Groups that are clipped by the remaining constraints, e.g. partial tiles
+  at the boundary of the domain, as well as maps that are not of this form
+  get None and have to be computed exactly.
+
+  :param bmap: The map from elements to group ids.
+  :param group_ids: The (n_groups, n_out) array of group ids.
+  :param scale: Scale the values.
+  """
+  exact = [None] * len(group_ids)
+  bmaps = []
+  isl.map(bmap).foreach_basic_map(bmaps.append)
+  if len(bmaps) != 1 or bmaps[0].dim(isl.ISL_DIM_TYPE.DIV) > 0:
+    return exact
+  bmap = bmaps[0]
+  n_in = bmap.dim(isl.ISL_DIM_TYPE.IN)
+  try:
+    eqs, ineqs = _constraint_matrices(bmap, _param_values(isl.set(bmap.range())))
+  except ValueError:
+    return exact
+
+  def split(rows):
+    on_group = (rows[:, 1 + n_in:] != 0).any(axis=1)
+    return rows[on_group], rows[~on_group]
+  (tile_eqs, clip_eqs), (tile_ineqs, clip_ineqs) = split(eqs), split(ineqs)
+  tile = np.vstack([tile_eqs, tile_ineqs])
+  if len(tile) == 0:
+    return exact
+  A, B = tile[:, 1:1 + n_in].astype(float), tile[:, 1 + n_in:].astype(float)
+  D = np.linalg.lstsq(A, -B, rcond=None)[0]
+  if not np.allclose(A @ D, -B):
+    return exact
+
+  # The shape of group 0, parameters are already substituted.
+  space = bmap.domain().get_space()
+  n_param = space.dim(isl.ISL_DIM_TYPE.PARAM)
+
+  def template_rows(rows):
+    cols = np.zeros((len(rows), 1 + n_param + n_in), dtype=np.int64)
+    cols[:, 0] = rows[:, 0]
+    cols[:, 1 + n_param:] = rows[:, 1:1 + n_in]
+    return _numpy_to_mat(cols)
+  template = isl.basic_set.from_constraint_matrices(
+      space, template_rows(tile_eqs), template_rows(tile_ineqs),
+      isl.ISL_DIM_TYPE.CST, isl.ISL_DIM_TYPE.PARAM, isl.ISL_DIM_TYPE.SET,
+      isl.ISL_DIM_TYPE.DIV)
+  if not template.is_bounded():
+    return exact
+  vertices = bset_get_vertex_coordinates(template, scale=1)
+  if len(vertices) == 0:
+    return exact
+  vertices = vertices[:, ::-1]
+
+  # vertices of every group: (n_groups, n_vertices, n_in)
+  moved = vertices[None, :, :] + (group_ids @ D.T)[:, None, :]
+  eps = 1e-9
+  inside = np.ones(len(group_ids), dtype=bool)
+  if len(clip_ineqs):
+    values = moved @ clip_ineqs[:, 1:1 + n_in].T + clip_ineqs[:, 0]
+    inside &= (values >= -eps).all(axis=(1, 2))
+  if len(clip_eqs):
+    values = moved @ clip_eqs[:, 1:1 + n_in].T + clip_eqs[:, 0]
+    inside &= (np.abs(values) <= eps).all(axis=(1, 2))
+  return [moved[i][:, ::-1] / scale if inside[i] else None for i in range(len(group_ids))]
+
+
+def get_bounding_box(set_data, offset=0) -> Tuple[np.ndarray, np.ndarray]:
+  """
+  Return the inclusive lower and upper corner of the bounding box of a set,
+  extended by offset in every dimension.
 
-    def __lt__(self, other):
-      return mycmp(self.obj, other.obj) < 0
+  :param set_data: The (basic|union|) set, its parameters must be fixed.
+  :param offset: The padding added on both sides of every dimension.
+  """
+  lo, hi = set_bounds(set_data)
+  return lo - offset, hi + offset
 
-    def __gt__(self, other):
-      return mycmp(self.obj, other.obj) > 0
 
-    def __eq__(self, other):
-      return mycmp(self.obj, other.obj) == 0
+@cached
+def get_rectangular_hull(set_data: isl.set, offset=0):
+  """
+  Return the bounding box of a set, extended by offset in every dimension,
+  as an isl set.
 
-    def __le__(self, other):
-      return mycmp(self.obj, other.obj) <= 0
+  The bounds are the symbolic dim_min/dim_max of every dimension, so the
+  hull of a parametric set is parametric as well. Use get_bounding_box for
+  the numeric corners of a set with fixed parameters.
 
-    def __ge__(self, other):
-      return mycmp(self.obj, other.obj) >= 0
+  :param set_data: The set.
+  :param offset: The padding added on both sides of every dimension.
+  """
+  space = set_data.get_space()
+  hull = isl.set.universe(space)
+  ls = isl.local_space.from_space(space)
+  pad = isl.pw_aff(isl.aff.zero_on_domain(ls).set_constant_si(offset))
+
+  for dim in range(set_data.dim(isl.ISL_DIM_TYPE.SET)):
+    dim_val = isl.pw_aff(isl.aff.zero_on_domain(ls).set_coefficient_si(isl.ISL_DIM_TYPE.IN, dim, 1))
+    lo = set_data.dim_min(dim).insert_domain(space).sub(pad)
+    hi = set_data.dim_max(dim).insert_domain(space).add(pad)
+    hull = hull.intersect(dim_val.ge_set(lo)).intersect(dim_val.le_set(hi))
+
+  return hull
 
-    def __ne__(self, other):
-      return mycmp(self.obj, other.obj) != 0
-  return Key
 
+def _point_key(point) -> Tuple[int, ...]:
+  if isinstance(point, isl.point):
+    return tuple(point.get_coordinate_val(isl.ISL_DIM_TYPE.SET, i).get_num_si()
+                 for i in range(point.space().dim(isl.ISL_DIM_TYPE.SET)))
+  return tuple(point)
 
-def sort_points(points):
+
+def sort_points(points, threshold=1024):
   """
   Given a list of points, sort them lexicographically.
 
-  :param points: The list of points that will be sorted.
+  The coordinates of every point are extracted once and compared as integer
+  tuples, which orders points of the same space the same way as isl's
+  lexicographic order. Large lists are sorted with numpy.lexsort.
+
+  :param points: The list of points that will be sorted, either isl points
+                 or coordinate lists as returned by the other helpers. A
+                 numpy array of points is sorted by its rows.
+  :param threshold: Lists with at least this many points are sorted with
+                    numpy.
   """
-  return sorted(points, key=cmp_to_key(cmp_points))
+  if isinstance(points, np.ndarray):
+    if len(points) == 0 or points.shape[1] == 0:
+      return points
+    return points[np.lexsort(points.T[::-1])]
+  points = list(points)
+  keys = [_point_key(p) for p in points]
+  if len(points) < threshold or len({len(k) for k in keys}) > 1:
+    order = sorted(range(len(points)), key=keys.__getitem__)
+  else:
+    order = np.lexsort(np.array(keys, dtype=np.int64).T[::-1])
+  return [points[i] for i in order]
 
 
 __all__ = ['bset_get_vertex_coordinates', 'bset_get_faces', 'set_get_faces',
            'get_vertices_and_faces', 'get_point_coordinates', 'bset_get_points',
-           'get_rectangular_hull', 'sort_points']
+           'get_rectangular_hull', 'sort_points', 'set_points', 'iter_set_points', 'set_bounds',
+           'map_edges', 'points_coordinates', 'get_bounding_box',
+           'group_vertex_coordinates']
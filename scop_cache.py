@@ -0,0 +1,191 @@
+import os
+import json
+import hashlib
+import tempfile
+from dataclasses import dataclass, asdict
+from typing import Optional
+import isl
+import pet
+from common import isl_lock, parse_code
+
+
+@dataclass
+class ScopSummary:
+    """ pet.scop 的多面体部分, 以 isl 文本保存, 可以不经过 clang 重建.
+
+    提供与 pet.scop 同名的 getter, 依赖分析的代码可以直接替换使用.
+    注意 stmt 的 body 无法从文本重建, 生成代码仍然需要原始的 pet.scop.
+    """
+    context: str
+    domain: str
+    schedule: str
+    may_reads: str
+    may_writes: str
+    must_writes: str
+    must_kills: str
+    tagged_may_reads: str
+    tagged_may_writes: str
+    tagged_must_writes: str
+
+    @staticmethod
+    def from_scop(scop: pet.scop) -> 'ScopSummary':
+        schedule: isl.schedule = scop.get_schedule()
+        return ScopSummary(context=str(scop.get_context()),
+                           domain=str(schedule.get_domain()),
+                           schedule=str(schedule),
+                           may_reads=str(scop.get_may_reads()),
+                           may_writes=str(scop.get_may_writes()),
+                           must_writes=str(scop.get_must_writes()),
+                           must_kills=str(scop.get_must_kills()),
+                           tagged_may_reads=str(scop.get_tagged_may_reads()),
+                           tagged_may_writes=str(scop.get_tagged_may_writes()),
+                           tagged_must_writes=str(scop.get_tagged_must_writes()))
+
+    def get_context(self) -> isl.set:
+        return isl.set(self.context)
+
+    def get_domain(self) -> isl.union_set:
+        return isl.union_set(self.domain)
+
+    def get_schedule(self) -> isl.schedule:
+        return isl.schedule(self.schedule)
+
+    def get_may_reads(self) -> isl.union_map:
+        return isl.union_map(self.may_reads)
+
+    def get_may_writes(self) -> isl.union_map:
+        return isl.union_map(self.may_writes)
+
+    def get_must_writes(self) -> isl.union_map:
+        return isl.union_map(self.must_writes)
+
+    def get_must_kills(self) -> isl.union_map:
+        return isl.union_map(self.must_kills)
+
+    def get_tagged_may_reads(self) -> isl.union_map:
+        return isl.union_map(self.tagged_may_reads)
+
+    def get_tagged_may_writes(self) -> isl.union_map:
+        return isl.union_map(self.tagged_may_writes)
+
+    def get_tagged_must_writes(self) -> isl.union_map:
+        return isl.union_map(self.tagged_must_writes)
+
+
+def _binding_version(module) -> str:
+    """ binding 没有导出版本号时, 用扩展模块的路径和修改时间代替. """
+    version = getattr(module, '__version__', '')
+    path = getattr(module, '__file__', None) or ''
+    mtime = os.path.getmtime(path) if os.path.exists(path) else 0
+    return f"{version}:{path}:{mtime}"
+
+
+class ScopCache:
+    """ 以源码内容寻址的 scop 磁盘缓存, 按总大小做 LRU 淘汰.
+
+    :param directory: 缓存目录, 默认为 $ISL_LEARN_SCOP_CACHE 或 ~/.cache/isl_learn/scops.
+    :param max_bytes: 缓存目录允许的最大字节数.
+    """
+
+    def __init__(self, directory: Optional[str] = None, max_bytes: int = 256 << 20) -> None:
+        if directory is None:
+            directory = os.environ.get('ISL_LEARN_SCOP_CACHE',
+                                       os.path.join(os.path.expanduser('~'), '.cache', 'isl_learn', 'scops'))
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, source: str, func_name: str) -> str:
+        h = hashlib.sha256()
+        for part in (source, func_name, _binding_version(pet), _binding_version(isl)):
+            h.update(part.encode())
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, source: str, func_name: str) -> Optional[ScopSummary]:
+        path = self._path(self.key(source, func_name))
+        try:
+            with open(path, 'r') as f:
+                summary = ScopSummary(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+        # 更新访问时间作为 LRU 的依据.
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return summary
+
+    def put(self, source: str, func_name: str, summary: ScopSummary) -> None:
+        path = self._path(self.key(source, func_name))
+        # 先写临时文件再原子替换, 多个进程同时写同一个 key 也是安全的.
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(asdict(summary), f)
+            os.replace(tmp, path)
+        except BaseException:
+            # 写入失败 (磁盘已满, 无法序列化, 被中断) 时不留下临时文件.
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        self.evict()
+
+    def evict(self) -> None:
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+            total += st.st_size
+        entries.sort()
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            total -= size
+
+    def clear(self) -> None:
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                os.remove(os.path.join(self.directory, name))
+
+    def extract(self, source: str, func_name: str) -> ScopSummary:
+        """ 命中缓存时直接从 isl 文本重建, 否则调用 pet 解析并写入缓存. """
+        summary = self.get(source, func_name)
+        if summary is not None:
+            self.hits += 1
+            return summary
+        self.misses += 1
+        with isl_lock:
+            summary = ScopSummary.from_scop(parse_code(source, func_name))
+        self.put(source, func_name, summary)
+        return summary
+
+
+_default_cache: Optional[ScopCache] = None
+
+
+def parse_code_cached(source: str, func_name: str, cache: Optional[ScopCache] = None) -> ScopSummary:
+    """ 带磁盘缓存的 parse_code, 返回 ScopSummary. """
+    global _default_cache
+    if cache is None:
+        if _default_cache is None:
+            _default_cache = ScopCache()
+        cache = _default_cache
+    return cache.extract(source, func_name)